@@ -1,8 +1,9 @@
 """
 The main Flask application package. This application makes use of blueprints.
 """
-from application.app import create_app
+from application.app import create_app, start_app
 
 # Global reference to the application, use 'from flask import current_app' to reference
-# this instance in dependent code, like the views and services.
-app = create_app()
+# this instance in dependent code, like the views and services. The startup tasks and background
+# jobs of this instance are started by the entrypoint, so that importing this package has no such side effects.
+app = create_app(start=False)
@@ -10,17 +10,21 @@ and use current_app to refer to the app instance
 import traceback
 
 from flask import Flask, jsonify
-from jose.exceptions import JWTClaimsError
+from jose.exceptions import JWTError
 
 from application import hti, spi, user, treatment, health
 from application.database import db
+from application.hti.registry import IssuerRegistry
+from application.http_client import http_client
 from application.security import AccessDenied
+from application.session import ServerSessionInterface
 
 
-def create_app(config=None) -> Flask:
+def create_app(config=None, start: bool = True) -> Flask:
     """
     Main init method that creates and configures the Flask app instance.
     :param config: an optional configuration mapping.
+    :param start: run the startup tasks and start the background jobs, see start_app.
     :return: an app instance
     """
     app = Flask(__name__, instance_relative_config=True)
@@ -32,13 +36,27 @@ def create_app(config=None) -> Flask:
         app.config.from_mapping(config)
     if 'APP_SECRET_KEY' in app.config:
         app.secret_key = app.config['APP_SECRET_KEY']
+    app.session_interface = ServerSessionInterface.from_config(app.config)
+    http_client.configure(app.config)
+    app.extensions['hti_issuers'] = IssuerRegistry.from_config(app.config)
     _, blueprint_spi, _, _, _ = register_blueprints(app)
     register_error_handlers(app, blueprint_spi)
     setup_database(app)
+    if start:
+        start_app(app)
 
     return app
 
 
+def start_app(app: Flask):
+    """
+    Runs the startup tasks and starts the background jobs of the app instance.
+    :param app: the Flask application instance.
+    """
+    init_services(app)
+    start_background_jobs(app)
+
+
 # pylint: disable=W0612
 def register_error_handlers(app, blueprint_spi):
     """
@@ -65,9 +83,11 @@ def register_error_handlers(app, blueprint_spi):
         response.status_code = error.status_code
         return response
 
-    @app.errorhandler(JWTClaimsError)
-    def handle_jwtclaimserror(error: JWTClaimsError):
-        traceback.print_exception(JWTClaimsError, error, None)
+    @app.errorhandler(JWTError)
+    def handle_jwterror(error: JWTError):
+        # JWTError covers the JWTClaimsError of an invalid claim, and the rejections of a bad token, like
+        # an unknown key id (kid) or a disallowed algorithm (alg)
+        traceback.print_exception(type(error), error, None)
         return blueprint_spi.error(400)
 
 
@@ -81,6 +101,36 @@ def setup_database(app: Flask):
         db.create_all()
 
 
+def init_services(app: Flask):
+    """
+    Initializes the treatments at startup rather than on the first request, when TREATMENT_EAGER_INIT is set.
+    Otherwise the treatments are initialized on first use, once. Preloads the static files of the spi in
+    memory when SPI_PRELOAD_STATIC is set.
+    :param app: the Flask application instance.
+    """
+    if app.config.get('TREATMENT_EAGER_INIT', False):
+        with app.app_context():
+            app.blueprints['treatment'].treatment_service.ensure_initialized()
+    if app.config.get('SPI_PRELOAD_STATIC', False):
+        app.blueprints['spi'].static_bundle.load(app.config.get('SPI_STATIC_CHECK_INTERVAL', 2.0))
+
+
+def start_background_jobs(app: Flask):
+    """
+    Starts the background jobs of the application.
+    :param app: the Flask application instance.
+    """
+    hti.services.jti_purge_job.start(app)
+    if app.config.get('TREATMENT_RELOAD_INTERVAL', 0) > 0:
+        watcher = treatment.services.TreatmentWatcher(app, app.blueprints['treatment'].treatment_service)
+        app.extensions['treatment_watcher'] = watcher
+        watcher.start()
+    if app.config.get('HTI_JWKS_REFRESH_ENABLED', False):
+        refresher = hti.services.JwksRefresher(app)
+        app.extensions['hti_jwks_refresher'] = refresher
+        refresher.start()
+
+
 def register_blueprints(app: Flask):
     """
     Method that registers the blueprints.
@@ -88,7 +138,7 @@ def register_blueprints(app: Flask):
     """
     blueprint_hti = hti.views.create_blueprint()
     app.register_blueprint(blueprint_hti)
-    blueprint_spi = spi.views.create_blueprint()
+    blueprint_spi = spi.views.create_blueprint(app.config.get('SPI_STATIC_FOLDER', 'static'))
     app.register_blueprint(blueprint_spi)
     blueprint_user = user.views.create_blueprint()
     app.register_blueprint(blueprint_user)
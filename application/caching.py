@@ -0,0 +1,31 @@
+"""
+HTTP caching of the JSON API responses: an ETag per response, so that a client that repeats a request
+with If-None-Match gets a 304 Not Modified without the body, and a configurable Cache-Control header.
+"""
+import hashlib
+import typing
+
+from flask import Response, request
+
+
+def etag_of(body: bytes) -> str:
+    """
+    Computes the ETag of a response body, compute it once for a pre-rendered body.
+    :param body: the response body.
+    :return: the ETag, without quotes.
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def conditional_response(response: Response, cache_control: str, etag: typing.Optional[str] = None) -> Response:
+    """
+    Sets the ETag and the Cache-Control header, and turns the response into a 304 Not Modified if the
+    ETag matches the If-None-Match header of the request.
+    :param response: the response.
+    :param cache_control: the Cache-Control header value.
+    :param etag: the ETag of the response, computed from the body if not set.
+    :return: the response.
+    """
+    response.set_etag(etag or etag_of(response.get_data()))
+    response.headers['Cache-Control'] = cache_control
+    return response.make_conditional(request)
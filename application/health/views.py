@@ -1,7 +1,10 @@
 """
 The view objects for this module.
 """
-from flask import Blueprint, jsonify
+from flask import Blueprint, current_app, jsonify
+
+from application.hti.services import hti_portal_service, jwks_discovery_service, jti_purge_job
+from application.http_client import http_client
 
 
 # pylint: disable=W0612
@@ -20,4 +23,42 @@ def create_blueprint() -> Blueprint:
         """
         return jsonify({'status': 'OK'})
 
+    @blueprint.route('/health/ready')
+    def ready():
+        """
+        The readiness of the application, the application is ready when the startup tasks have completed.
+        :return: JSON map of the status and the startup tasks, with status 503 if not ready.
+        """
+        refresher = current_app.extensions.get('hti_jwks_refresher')
+        treatment_service = current_app.blueprints['treatment'].treatment_service
+        checks = {'jwks': refresher is None or refresher.ready.is_set(),
+                  'treatments': treatment_service.initialized or not current_app.config.get('TREATMENT_EAGER_INIT',
+                                                                                             False)}
+        is_ready = all(checks.values())
+        return jsonify({'status': 'READY' if is_ready else 'NOT_READY', 'checks': checks}), 200 if is_ready else 503
+
+    @blueprint.route('/health/metrics')
+    def metrics():
+        """
+        The counters of the caches of the application for monitoring purposes.
+        :return: JSON map of the counters.
+        """
+        refresher = current_app.extensions.get('hti_jwks_refresher')
+        treatment_service = current_app.blueprints['treatment'].treatment_service
+        watcher = current_app.extensions.get('treatment_watcher')
+        return jsonify({'jwks_cache': jwks_discovery_service.cache.stats(),
+                        'jwks_fetches': jwks_discovery_service.fetches.stats(),
+                        'jwks_unknown_kids': jwks_discovery_service.unknown_kids.stats(),
+                        'jwks_forced_refreshes': jwks_discovery_service.forced_refreshes.stats(),
+                        'rejected_tokens': hti_portal_service.rejections.stats(),
+                        'http_client': http_client.stats(),
+                        'jti_store': jti_purge_job.stats(),
+                        'jwks_refresher': refresher.stats() if refresher else None,
+                        'sessions': current_app.session_interface.store.stats(),
+                        'treatment_catalog': dict(treatment_service.catalog.stats(),
+                                                  init_seconds=treatment_service.init_seconds,
+                                                  source=treatment_service.source),
+                        'treatment_watcher': watcher.stats() if watcher else None,
+                        'spi_static': current_app.blueprints['spi'].static_bundle.stats()})
+
     return blueprint
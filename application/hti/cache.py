@@ -0,0 +1,329 @@
+"""
+The caches of this module. The JwksCache keeps the JWKS key sets of the portals in memory, so that a launch
+does not have to fetch the jwks.json of the portal on every request, the SingleFlight makes sure that
+concurrent requests do not fetch the same jwks.json at the same time.
+"""
+import re
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+from jose.backends.base import Key
+
+from application.hti.crypto import construct_key
+
+_MAX_AGE = re.compile(r'max-age\s*=\s*"?(\d+)"?', re.IGNORECASE)
+
+
+def parse_max_age(cache_control: typing.Optional[str]) -> typing.Optional[int]:
+    """
+    Parses the max-age from a Cache-Control header value.
+    :param cache_control: the Cache-Control header value, if any.
+    :return: the max-age in seconds, 0 if the response may not be cached, or None if not specified.
+    """
+    if not cache_control:
+        return None
+    directives = cache_control.lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    match = _MAX_AGE.search(directives)
+    return int(match.group(1)) if match else None
+
+
+class JwksCacheEntry:  # pylint: disable=R0903
+    """
+    The key set of a single JWKS URL. The JWKs are indexed by their key id (kid), the constructed keys
+    are created on first use and indexed by key id (kid) and algorithm. After expiry, the key set may
+    be served as the last known good key set until stale_until, when the portal cannot be reached.
+    """
+    __slots__ = ('jwks', 'keys', 'expires_at', 'stale_until')
+
+    def __init__(self, jwks: typing.Dict[str, dict], expires_at: float, stale_until: float = None):
+        self.jwks = jwks
+        self.keys: typing.Dict[typing.Tuple[str, str], Key] = {}
+        self.expires_at = expires_at
+        self.stale_until = expires_at if stale_until is None else stale_until
+
+    def get_key(self, kid: str, alg: str) -> Key:
+        """
+        Gets the constructed key by key id (kid) and algorithm.
+        :param kid: the key id (kid).
+        :param alg: the algorithm of the token.
+        :return: the constructed key.
+        """
+        key = self.keys.get((kid, alg))
+        if key is None:
+            key = construct_key(self.jwks[kid], alg)
+            self.keys[(kid, alg)] = key
+        return key
+
+
+class JwksCache:
+    """
+    Thread safe LRU cache of JWKS key sets, indexed by the JWKS URL of the issuer.
+    """
+
+    def __init__(self, clock: typing.Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_serves = 0
+        self._entries: 'OrderedDict[str, JwksCacheEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_key(self, url: str, kid: str, alg: str) -> typing.Optional[Key]:
+        """
+        Looks up a key in the cache.
+        :param url: the JWKS URL.
+        :param kid: the key id (kid).
+        :param alg: the algorithm of the token.
+        :return: the constructed key, or None if the key set has expired or does not contain the key id (kid).
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None or entry.expires_at <= self.clock() or kid not in entry.jwks:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            self.hits += 1
+            return entry.get_key(kid, alg)
+
+    def peek(self, url: str) -> typing.Optional[JwksCacheEntry]:
+        """
+        Gets the key set of the URL, expired or not, without counting a hit or miss.
+        :param url: the JWKS URL.
+        :return: the cache entry, if any.
+        """
+        with self._lock:
+            return self._entries.get(url)
+
+    def put(self, url: str, keys: typing.List[dict], ttl: float, max_size: int,  # pylint: disable=R0913
+            max_staleness: float = 0) -> JwksCacheEntry:
+        """
+        Stores the keys of a JWKS document, replacing the previous key set of the URL.
+        :param url: the JWKS URL.
+        :param keys: the keys of the JWKS document.
+        :param ttl: the time to live in seconds.
+        :param max_size: the maximum number of key sets to keep, the least recently used are evicted.
+        :param max_staleness: the number of seconds after expiry the key set may be served as last known good.
+        :return: the new cache entry.
+        """
+        expires_at = self.clock() + ttl
+        entry = JwksCacheEntry({key['kid']: key for key in keys if 'kid' in key}, expires_at,
+                               expires_at + max_staleness)
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def serve_stale(self, url: str, retry_after: float) -> typing.Optional[JwksCacheEntry]:
+        """
+        Keeps serving the last known good key set of the URL for another retry_after seconds, when the
+        key set could not be refreshed and has not been stale for longer than allowed.
+        :param url: the JWKS URL.
+        :param retry_after: the number of seconds before the next refresh attempt.
+        :return: the cache entry, or None if there is no key set or it is too stale.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+            now = self.clock()
+            if entry is None or entry.stale_until <= now:
+                return None
+            entry.expires_at = min(now + retry_after, entry.stale_until)
+            self.stale_serves += 1
+            return entry
+
+    def clear(self):
+        """
+        Removes all key sets from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        The counters of this cache.
+        :return: the counters as dict.
+        """
+        with self._lock:
+            return {'size': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'stale_serves': self.stale_serves}
+
+
+class _Call:  # pylint: disable=R0903
+    """
+    A call in flight of the SingleFlight.
+    """
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls by key: only one call per key is in flight at a time, the
+    other callers wait for the result of that call.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self._in_flight: typing.Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, function: typing.Callable[[], typing.Any], timeout: float):
+        """
+        Calls the function, or waits for the result of the call with the same key that is already in flight.
+        :param key: the key of the call.
+        :param function: the function to call.
+        :param timeout: the maximum number of seconds to wait for a call in flight.
+        :return: the result of the function.
+        :raises: TimeoutError if the call in flight did not complete in time, or the error of the function.
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._in_flight[key] = call
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = function()
+                return call.result
+            except Exception as error:
+                call.error = error
+                raise
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                call.done.set()
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError(f'Timed out after {timeout} seconds waiting for {key}')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self) -> dict:
+        """
+        The counters of this instance.
+        :return: the counters as dict.
+        """
+        with self._lock:
+            return {'in_flight': len(self._in_flight),
+                    'calls': self.calls,
+                    'coalesced': self.coalesced,
+                    'timeouts': self.timeouts}
+
+
+class NegativeCache:
+    """
+    Thread safe, bounded LRU cache of rejections with a short time to live, so that a repeated bad
+    request is rejected without repeating the work, or the outbound traffic, of the first rejection.
+    """
+
+    def __init__(self, clock: typing.Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.hits = 0
+        self.evictions = 0
+        self._entries: 'OrderedDict[typing.Hashable, typing.Tuple[str, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: typing.Hashable) -> typing.Optional[str]:
+        """
+        Looks up a rejection.
+        :param key: the key of the rejection.
+        :return: the message of the rejection, or None if not cached or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            message, expires_at = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self.hits += 1
+            return message
+
+    def put(self, key: typing.Hashable, message: str, ttl: float, max_size: int):
+        """
+        Stores a rejection.
+        :param key: the key of the rejection.
+        :param message: the message of the rejection.
+        :param ttl: the time to live in seconds.
+        :param max_size: the maximum number of rejections to keep, the least recently stored are evicted.
+        """
+        with self._lock:
+            self._entries[key] = (message, self.clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        """
+        The counters of this cache.
+        :return: the counters as dict.
+        """
+        with self._lock:
+            return {'size': len(self._entries),
+                    'hits': self.hits,
+                    'evictions': self.evictions}
+
+
+class RateLimiter:
+    """
+    Allows an action at most once per interval per key.
+    """
+
+    def __init__(self, clock: typing.Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.allowed = 0
+        self.suppressed = 0
+        self._last: typing.Dict[typing.Hashable, float] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: typing.Hashable, interval: float) -> bool:
+        """
+        Checks if the action is allowed, and if so, records it.
+        :param key: the key of the action.
+        :param interval: the minimum number of seconds between two actions with the same key.
+        :return: True if the action is allowed.
+        """
+        with self._lock:
+            now = self.clock()
+            last = self._last.get(key)
+            if last is not None and now - last < interval:
+                self.suppressed += 1
+                return False
+            self._last[key] = now
+            self.allowed += 1
+            return True
+
+    def stats(self) -> dict:
+        """
+        The counters of this limiter.
+        :return: the counters as dict.
+        """
+        with self._lock:
+            return {'allowed': self.allowed,
+                    'suppressed': self.suppressed}
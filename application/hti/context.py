@@ -0,0 +1,58 @@
+"""
+The launch context: the fields of the FHIR Task of the HTI launch that this module makes use of. The task is
+parsed and validated once at launch, the views read the fields of the context from the session.
+"""
+import typing
+
+from flask import session
+from jose.exceptions import JWTClaimsError
+
+ACTIVITY_DEFINITION = 'ActivityDefinition/'
+
+
+class LaunchContext(typing.NamedTuple):
+    """
+    The validated launch context, a tuple so that it is compact in the session store.
+    """
+    treatment_id: int
+    user_reference: str
+    task_id: typing.Optional[str]
+
+    @classmethod
+    def from_task(cls, task: typing.Any) -> 'LaunchContext':
+        """
+        Parses the FHIR Task of the launch token.
+        :param task: the task claim of the launch token.
+        :return: the launch context.
+        :raises: JWTClaimsError if the task is malformed.
+        """
+        try:
+            definition_reference = task['definitionReference']['reference']
+            user_reference = task['for']['reference']
+            task_id = task.get('id')
+        except (KeyError, TypeError, AttributeError) as error:
+            raise JWTClaimsError(f'Invalid task: missing {error}') from error
+        if not isinstance(definition_reference, str) or ACTIVITY_DEFINITION not in definition_reference:
+            raise JWTClaimsError(f'Invalid task: {definition_reference} is not an {ACTIVITY_DEFINITION} reference')
+        try:
+            treatment_id = int(definition_reference.rpartition(ACTIVITY_DEFINITION)[2])
+        except ValueError as error:
+            raise JWTClaimsError(f'Invalid task: {definition_reference} is not an {ACTIVITY_DEFINITION} reference') \
+                from error
+        if not isinstance(user_reference, str) or not user_reference:
+            raise JWTClaimsError('Invalid task: the for reference must be a string')
+        if task_id is not None and not isinstance(task_id, str):
+            raise JWTClaimsError('Invalid task: the id must be a string')
+        return cls(treatment_id, user_reference, task_id)
+
+
+def current_launch() -> typing.Optional[LaunchContext]:
+    """
+    The launch context of the current session.
+    :return: the launch context, or None if the session has not been launched.
+    """
+    launch = session.get('launch')
+    if launch is None or isinstance(launch, LaunchContext):
+        return launch
+    # the SQL session store returns the tuple as a JSON list
+    return LaunchContext._make(launch)
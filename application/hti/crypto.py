@@ -0,0 +1,152 @@
+"""
+Signature verification of the launch tokens. The public keys are constructed with python-jose, except for
+the algorithms python-jose lacks: the PS256/PS384/PS512 and EdDSA keys are constructed with the native
+cryptography package when it is installed.
+"""
+import typing
+
+from jose import jwk
+from jose.backends.base import Key
+from jose.constants import ALGORITHMS
+from jose.exceptions import JWKError
+from jose.utils import base64url_decode, base64url_encode
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, ed448, padding, rsa
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat, load_pem_public_key
+except ImportError:
+    rsa = None
+
+EDDSA = 'EdDSA'
+
+# All asymmetric signature algorithms this module can verify, the HMAC algorithms are excluded on purpose.
+SIGNATURE_ALGORITHMS = ('RS256', 'RS384', 'RS512', 'PS256', 'PS384', 'PS512', 'ES256', 'ES384', 'ES512', EDDSA)
+
+# The algorithms python-jose does not support, these are verified with the cryptography package.
+NATIVE_ALGORITHMS = ('PS256', 'PS384', 'PS512', EDDSA)
+
+_EC_CURVES = {'ES256': 'P-256', 'ES384': 'P-384', 'ES512': 'P-521'}
+
+
+def _int(value: str) -> int:
+    return int.from_bytes(base64url_decode(value.encode('ascii')), 'big')
+
+
+def _b64(value: int, length: int = None) -> str:
+    data = value.to_bytes(length or (value.bit_length() + 7) // 8, 'big')
+    return base64url_encode(data).decode('ascii')
+
+
+class NativeKey:  # pylint: disable=R0903
+    """
+    A public key backed by the cryptography package for the NATIVE_ALGORITHMS, with the verify interface of the
+    python-jose keys.
+    """
+    __slots__ = ('algorithm', '_verify')
+
+    def __init__(self, key_data: dict, algorithm: str):
+        """
+        Constructs the key from a JWK.
+        :param key_data: the JWK.
+        :param algorithm: the algorithm of the token.
+        :raises: JWKError if the key type does not match the algorithm.
+        """
+        self.algorithm = algorithm
+        kty = key_data.get('kty')
+        if algorithm in ('PS256', 'PS384', 'PS512'):
+            if kty != 'RSA':
+                raise JWKError(f'Incorrect key type {kty} for {algorithm}')
+            public_key = rsa.RSAPublicNumbers(_int(key_data['e']), _int(key_data['n'])).public_key()
+            digest = getattr(hashes, f'SHA{algorithm[2:]}')()
+            pad = padding.PSS(mgf=padding.MGF1(digest), salt_length=digest.digest_size)
+            self._verify = lambda data, signature: public_key.verify(signature, data, pad, digest)
+        elif algorithm == EDDSA:
+            if kty != 'OKP' or key_data.get('crv') not in ('Ed25519', 'Ed448'):
+                raise JWKError(f'Incorrect key type {kty} {key_data.get("crv")} for {algorithm}')
+            key_class = ed25519.Ed25519PublicKey if key_data['crv'] == 'Ed25519' else ed448.Ed448PublicKey
+            public_key = key_class.from_public_bytes(base64url_decode(key_data['x'].encode('ascii')))
+            self._verify = lambda data, signature: public_key.verify(signature, data)
+        else:
+            raise JWKError(f'Unsupported algorithm {algorithm}')
+
+    def verify(self, msg: bytes, sig: bytes) -> bool:
+        """
+        Verifies the signature.
+        :param msg: the signing input.
+        :param sig: the signature.
+        :return: True if the signature is valid.
+        """
+        try:
+            self._verify(msg, sig)
+            return True
+        except InvalidSignature:
+            return False
+
+
+def construct_key(key_data: dict, algorithm: str = None) -> typing.Union[NativeKey, Key]:
+    """
+    Constructs a public key for the algorithm, with python-jose, or with the cryptography package for the
+    NATIVE_ALGORITHMS.
+    :param key_data: the JWK.
+    :param algorithm: the algorithm of the token, defaults to the alg of the JWK.
+    :return: the key.
+    :raises: JWKError if the key cannot be constructed for the algorithm.
+    """
+    algorithm = algorithm or key_data.get('alg')
+    if algorithm in NATIVE_ALGORITHMS:
+        if rsa is None:
+            raise JWKError(f'The {algorithm} algorithm requires the cryptography package')
+        try:
+            return NativeKey(key_data, algorithm)
+        except (KeyError, ValueError) as error:
+            raise JWKError(f'Invalid key for {algorithm}: {error}') from error
+    if algorithm in _EC_CURVES and key_data.get('crv') != _EC_CURVES[algorithm]:
+        # python-jose accepts a key of any curve for the ES algorithms
+        raise JWKError(f'Incorrect curve {key_data.get("crv")} for {algorithm}')
+    return jwk.construct(key_data, algorithm)
+
+
+def default_algorithm(key_data: dict) -> str:
+    """
+    The algorithm of a JWK without alg, derived from the key type (kty) and curve (crv).
+    :param key_data: the JWK.
+    :return: ES256, ES384 or ES512 for an EC key, EdDSA for an OKP key, else RS512.
+    """
+    kty = key_data.get('kty')
+    if kty == 'EC':
+        for algorithm, crv in _EC_CURVES.items():
+            if key_data.get('crv') == crv:
+                return algorithm
+    if kty == 'OKP':
+        return EDDSA
+    return ALGORITHMS.RS512
+
+
+def pem_to_jwk(pem: str, algorithm: str = None) -> dict:
+    """
+    Converts a PEM encoded public key to a JWK.
+    :param pem: the PEM encoded public key.
+    :param algorithm: the algorithm of the key, defaults to the algorithm of the key type, see default_algorithm.
+    :return: the JWK.
+    """
+    if rsa is None:
+        return jwk.construct(pem, algorithm or ALGORITHMS.RS512).to_dict()
+    public_key = load_pem_public_key(pem.encode('utf8'))
+    if isinstance(public_key, rsa.RSAPublicKey):
+        numbers = public_key.public_numbers()
+        key_data = {'kty': 'RSA', 'n': _b64(numbers.n), 'e': _b64(numbers.e)}
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        numbers = public_key.public_numbers()
+        length = (public_key.curve.key_size + 7) // 8
+        crv = {'secp256r1': 'P-256', 'secp384r1': 'P-384', 'secp521r1': 'P-521'}[public_key.curve.name]
+        key_data = {'kty': 'EC', 'crv': crv, 'x': _b64(numbers.x, length), 'y': _b64(numbers.y, length)}
+    elif isinstance(public_key, (ed25519.Ed25519PublicKey, ed448.Ed448PublicKey)):
+        crv = 'Ed25519' if isinstance(public_key, ed25519.Ed25519PublicKey) else 'Ed448'
+        raw = public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+        key_data = {'kty': 'OKP', 'crv': crv, 'x': base64url_encode(raw).decode('ascii')}
+    else:
+        raise JWKError(f'Unsupported public key {type(public_key).__name__}')
+    key_data['alg'] = algorithm or default_algorithm(key_data)
+    return key_data
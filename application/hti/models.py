@@ -10,6 +10,8 @@ from application.database import db
 @dataclass
 class JwtId(db.Model):
     """
-    The JwtId represents a the persisted JWT identifier.
+    The JwtId represents a the persisted JWT identifier. The expiration time (exp) of the token is
+    stored as seconds since the epoch, the index on it is used for purging the expired identifiers.
     """
     id = db.Column(db.String(256), primary_key=True, autoincrement=False)
+    exp = db.Column(db.BigInteger, index=True)
@@ -0,0 +1,135 @@
+"""
+The issuer registry of this module. The registry holds the portals that are allowed to launch this
+module, indexed by issuer (iss), and is loaded once at startup.
+"""
+import math
+import typing
+
+import yaml
+from flask import Config
+from jose.backends.base import Key
+
+from application.hti.cache import JwksCacheEntry
+from application.hti.crypto import SIGNATURE_ALGORITHMS, construct_key, default_algorithm, pem_to_jwk
+
+
+def jwks_url_of(issuer: str) -> str:
+    """
+    Composes the JWKS URL of the issuer (iss) as https://<issuer>/.well-known/jwks.json
+    :param issuer: the issuer (iss).
+    :return: an URL.
+    """
+    domain = issuer
+    if not domain.startswith('http'):
+        domain = f'https://{domain}'
+
+    if not domain.endswith('/'):
+        domain = f'{domain}/'
+
+    return f'{domain}.well-known/jwks.json'
+
+
+class Issuer:  # pylint: disable=R0903
+    """
+    A portal that is allowed to launch this module. A portal either has pinned keys, or its keys
+    are discovered at the JWKS URL. The audience (aud) overrides the own hostname of the module.
+    """
+    __slots__ = ('issuer', 'jwks_url', 'audience', 'pinned')
+
+    def __init__(self, issuer: str, keys: typing.List[typing.Union[str, dict]] = None, jwks_url: str = None,
+                 audience: str = None):
+        self.issuer = issuer
+        self.jwks_url = jwks_url or jwks_url_of(issuer)
+        self.audience = audience
+        self.pinned = None
+        if keys:
+            self.pinned = JwksCacheEntry(dict(self._load_key(index, key) for index, key in enumerate(keys)), math.inf)
+
+    @staticmethod
+    def _load_key(index: int, key: typing.Union[str, dict]) -> (str, dict):
+        """
+        Loads a pinned key, either a JWK or a PEM encoded public key with an optional kid and alg. The alg
+        defaults to the algorithm of the key type, see default_algorithm.
+        :return: the key id (kid) and the JWK.
+        """
+        if isinstance(key, str):
+            key = {'pem': key}
+        if 'pem' in key:
+            jwk_dict = pem_to_jwk(key['pem'], key.get('alg'))
+            jwk_dict['kid'] = key.get('kid', str(index))
+            key = jwk_dict
+        key = dict(key)
+        key.setdefault('alg', default_algorithm(key))
+        key.setdefault('kid', str(index))
+        # validate the key on startup rather than on the first launch
+        construct_key(key)
+        return key['kid'], key
+
+    def get_pinned_key(self, kid: typing.Optional[str], alg: str) -> typing.Optional[Key]:
+        """
+        Looks up a pinned key by key id (kid), a token without key id (kid) matches the only pinned key.
+        :param kid: the key id (kid) of the token, if any.
+        :param alg: the algorithm of the token.
+        :return: the key, or None if not found.
+        """
+        if kid is None and len(self.pinned.jwks) == 1:
+            kid = next(iter(self.pinned.jwks))
+        if kid not in self.pinned.jwks:
+            return None
+        return self.pinned.get_key(kid, alg)
+
+
+class IssuerRegistry:
+    """
+    The registry of the allowed issuers and the allowed signature algorithms.
+    """
+
+    def __init__(self, issuers: typing.Iterable[Issuer], algorithms: typing.Iterable[str] = SIGNATURE_ALGORITHMS):
+        self.issuers: typing.Dict[str, Issuer] = {issuer.issuer: issuer for issuer in issuers}
+        self.algorithms: typing.FrozenSet[str] = frozenset(algorithms)
+
+    def get(self, issuer: typing.Optional[str]) -> typing.Optional[Issuer]:
+        """
+        Looks up the issuer.
+        :param issuer: the issuer (iss).
+        :return: the issuer, or None if the issuer is not allowed.
+        """
+        return self.issuers.get(issuer)
+
+    def is_allowed(self, issuer: typing.Optional[str]) -> bool:
+        """
+        Checks if the issuer is allowed.
+        :param issuer: the issuer (iss).
+        :return: True if the issuer is allowed.
+        """
+        return issuer in self.issuers
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'IssuerRegistry':
+        """
+        Loads the registry from the configuration. The signature algorithms are restricted to HTI_ALLOWED_ALGORITHMS,
+        if set. The issuers of HTI_ALLOWED_PORTALS make use of jwks discovery,
+        the issuers of the HTI_ISSUERS mapping and of the HTI_ISSUERS_FILE (YAML or JSON) can have pinned keys, a
+        jwks_url override and an audience:
+
+        https://portal.example.com:
+          audience: module.example.com
+          keys:
+            - kid: key-1
+              pem: |
+                -----BEGIN PUBLIC KEY-----
+                ...
+        :param config: the application configuration.
+        :return: the registry.
+        """
+        entries: typing.Dict[str, dict] = {}
+        for issuer in config.get('HTI_ALLOWED_PORTALS', '').split(','):
+            if issuer.strip():
+                entries[issuer.strip()] = {}
+        entries.update(config.get('HTI_ISSUERS') or {})
+        if config.get('HTI_ISSUERS_FILE'):
+            with open(config['HTI_ISSUERS_FILE'], 'rt', encoding='utf8') as file:
+                entries.update(yaml.safe_load(file) or {})
+        algorithms = [alg.strip() for alg in config.get('HTI_ALLOWED_ALGORITHMS', '').split(',') if alg.strip()]
+        return cls((Issuer(issuer, **(entry or {})) for issuer, entry in entries.items()),
+                   algorithms or SIGNATURE_ALGORITHMS)
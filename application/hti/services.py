@@ -1,16 +1,26 @@
 """
 The services module of this blueprint.
 """
+import hashlib
 import json
-from urllib.request import urlopen
+import random
+import threading
+import time
 
-from flask import current_app
-from jose import jwt
-from jose.constants import ALGORITHMS
+from flask import current_app, Flask
+from jose.backends.base import Key
 from jose.exceptions import JWTClaimsError, JWTError
+from sqlalchemy.exc import IntegrityError
 
 from application.database import db
+from application.http_client import HttpError, http_client
+from application.hti.cache import JwksCache, JwksCacheEntry, NegativeCache, RateLimiter, SingleFlight, \
+    parse_max_age
+from application.hti.context import LaunchContext
+from application.hti.crypto import default_algorithm
 from application.hti.models import JwtId
+from application.hti.registry import Issuer, IssuerRegistry
+from application.hti.token import ParsedToken
 
 JWT_VALIDATION_OPTIONS = {
     'require_aud': True,
@@ -19,6 +29,16 @@ JWT_VALIDATION_OPTIONS = {
     'require_jti': True}
 
 
+def rejection_key(token: str) -> bytes:
+    """
+    The key of a rejected token in the negative cache, a digest so that the size of the cache does not depend
+    on the size of the tokens.
+    :param token: the encoded token.
+    :return: the SHA-256 digest of the token.
+    """
+    return hashlib.sha256(token.encode('utf8')).digest()
+
+
 class HtiLaunchService:
     """
     The HtiLaunchService is responsible form managing the HTI launches.
@@ -33,33 +53,41 @@ class HtiLaunchService:
         modules MAY make use of jwks discovery.
 
         If the portal do not support  jwks discovery, the module application should persist
-        the public key associated with the issuer (iss) and look it up.
+        the public key associated with the issuer (iss) and look it up. This implementation
+        supports both, see the IssuerRegistry.
 
         The HtiPortalService is responsible for looking up the key in this implementation.
+
+        The token is split and decoded once, the ParsedToken is used for the key lookup and the verification.
+        The task is parsed into the launch context before the JWT ID is registered.
         :param token: the JWT token
-        :param host: the own hostname
-        :return: the HTI task encoded in the token
+        :param host: the own hostname, the expected audience (aud) unless the issuer has an audience configured
+        :return: the launch context of the HTI task encoded in the token
+        :except: JWTClaimsError if the token or the task is invalid.
         """
-        issuer, key = hti_portal_service.get_portal(token)
-        decode = jwt.decode(token, key, options=JWT_VALIDATION_OPTIONS, audience=host, issuer=issuer)
+        rejection = hti_portal_service.rejections.get(rejection_key(token))
+        if rejection is not None:
+            raise JWTClaimsError(rejection)
+        parsed = ParsedToken(token)
+        portal, key = hti_portal_service.get_portal(parsed)
+        decode = parsed.verify(key, JWT_VALIDATION_OPTIONS, audience=portal.audience or host, issuer=portal.issuer)
+        context = LaunchContext.from_task(decode.get('task'))
         self.replay_detection(decode)
-        task = decode['task']
-        return task
+        return context
 
     @staticmethod
     def replay_detection(decode):
         """
-        This method prevents replay attacks by checking if the JWT ID has not been seen before.
+        This method prevents replay attacks by checking if the JWT ID has not been seen before. The
+        check and the registration of the JWT ID are a single atomic insert.
         :param decode: the decoded token
         :return: None
         :except: JWTClaimsError if the JWT ID has already been seen.
         """
         jti = decode['jti']
-        if jwt_model_service.exists_jti(jti):
+        if not jwt_model_service.register_jti(jti, int(decode['exp'])):
             raise JWTClaimsError('The JWT ID is not valid (jti)')
 
-        jwt_model_service.store_jti(jti)
-
 
 class HtiPortalService:
     """
@@ -69,112 +97,243 @@ class HtiPortalService:
     1. Store or configure the public key of the portal and retrieve it by the value of the issuer (iss).
     2. Make use of the jwks discovery mechanism.
 
-    This reference implementation makes use of jwks discovery method.
+    This reference implementation supports both: the IssuerRegistry holds the allowed issuers, an
+    issuer with pinned keys needs no network I/O, the keys of the other issuers are discovered.
+
+    Tokens of an issuer that is not allowed are remembered by their SHA-256 digest for HTI_NEGATIVE_CACHE_TTL seconds,
+    a repeated token is rejected without decoding it again.
     """
 
-    def get_portal(self, token: str) -> (str, dict):
+    def __init__(self):
+        self.rejections = NegativeCache()
+
+    def get_portal(self, token: ParsedToken) -> (Issuer, Key):
         """
-        This method makes of of the jwks discovery mechanism. First it tries to get the issuer from
-        the token, checks if the issuer is allowed, and if so, returns the associated public key.
-        :param token: an encoded token
+        First it tries to get the issuer from the token, checks if the issuer is allowed, and if so, returns
+        the associated public key, either a pinned key or a key found with the jwks discovery mechanism.
+        :param token: the parsed token
         :return: the issuer and public key, if any.
-        :raises: JWTClaimsError if the issuer is not allowed
+        :raises: JWTClaimsError if the issuer is not allowed, JWTError if the algorithm is not allowed or no key is found
         """
-        issuer = jwks_discovery_service.get_issuer(token)
-        if self.is_allowed_issuer(issuer):
-            key: dict = jwks_discovery_service.discover_public_key_with_jwks(token)
+        issuer = token.issuer
+        registry = self.get_registry()
+        portal = registry.get(issuer)
+        if portal is None:
+            message = f'The issuer (iss) {str(issuer)[:256]} is not allowed, please set the HTI_ALLOWED_PORTALS ' \
+                      f'enironment value.'
+            self.rejections.put(rejection_key(token.token), message, current_app.config.get('HTI_NEGATIVE_CACHE_TTL', 60),
+                                current_app.config.get('HTI_NEGATIVE_CACHE_SIZE', 1024))
+            raise JWTClaimsError(message)
+
+        if token.alg not in registry.algorithms:
+            raise JWTError(f'The algorithm (alg) {token.alg} is not allowed, please set the HTI_ALLOWED_ALGORITHMS '
+                           f'environment value.')
+
+        if portal.pinned is not None:
+            key = portal.get_pinned_key(token.kid, token.alg)
             if key is None:
-                raise JWTError(f'Cannot discover the jwks at {jwks_discovery_service.get_jwks_url(token)}')
-            return issuer, key
+                raise JWTError(f'The key (kid) {token.kid} is not configured for the issuer (iss) {issuer}')
+            return portal, key
 
-        raise JWTClaimsError(f'The issuer (iss) {issuer} is not allowed, please set the HTI_ALLOWED_PORTALS '
-                             f'enironment value.')
+        key: Key = jwks_discovery_service.discover_public_key_with_jwks(token, portal.jwks_url)
+        if key is None:
+            raise JWTError(f'Cannot find the key (kid) {token.kid} in the jwks at {portal.jwks_url}')
+        return portal, key
 
     @staticmethod
-    def is_allowed_issuer(issuer):
+    def get_registry() -> IssuerRegistry:
         """
-        Checks if the configuration allows this issuer to
-        :param issuer:
-        :return:
+        Gets the issuer registry of the application, as loaded by create_app.
+        :return: the issuer registry.
         """
-        allowed_portals = current_app.config['HTI_ALLOWED_PORTALS'].split(',')
-        allowed_portals = {x.strip() for x in allowed_portals}
-        return issuer in allowed_portals
+        return current_app.extensions['hti_issuers']
 
 
 class JwksDiscoveryService:
     """
     This service discovers the public key of a portal with the jwks discovery mechanism.
     The token is queried by https://<issuer domain>/.well-known/jwks.json
+
+    The key sets are cached per JWKS URL, the jwks.json is only fetched again if the key set has
+    expired or if the key id (kid) of the token is not in the cached key set. Concurrent fetches of
+    the same URL are coalesced, only one fetch per URL is in flight at a time.
+
+    A key id (kid) that is not in the fetched key set is remembered for HTI_NEGATIVE_CACHE_TTL seconds, and
+    a key set that has not expired is refreshed for an unknown key id (kid) at most once every
+    HTI_JWKS_MIN_REFRESH_INTERVAL seconds per URL, so that bad tokens do not cause outbound traffic.
     """
 
-    def discover_public_key_with_jwks(self, token: str) -> dict:
+    def __init__(self):
+        self.cache = JwksCache()
+        self.fetches = SingleFlight()
+        self.unknown_kids = NegativeCache()
+        self.forced_refreshes = RateLimiter()
+
+    def discover_public_key_with_jwks(self, token: ParsedToken, url: str) -> Key:
         """
         This method gets the public key with the JWKS discovery method.
-        :param token: the encoded token.
+        :param token: the parsed token.
+        :param url: the JWKS URL of the issuer.
         :return: the JWKS key if found, else none.
         """
-        url = self.get_jwks_url(token)
-        kid = self.get_kid(token)
+        kid = token.kid
         if kid is not None and url is not None:
-            return self.get_jwks_by_kid(url, kid)
+            return self.get_jwks_by_kid(url, kid, token.alg)
         return None
 
-    def get_jwks_url(self, token: str):
+    def get_jwks_by_kid(self, url: str, kid: str, alg: str = None) -> Key:
         """
-        Gets the JWKS URL based on the issuer (iss). The URL is composed as
-        https://<issuer>/.well-known/jwks.json
-        :param token: the encoded token.
-        :return: an URL.
+        Looks up the public key by its id (kid) in the cache. If the key set of the URL has expired
+        or does not contain the key id (kid), the URL is fetched and the JWKS json file parsed again.
+        :param url: the JWKS URL.
+        :param kid: the key id (kid) to look for.
+        :param alg: the algorithm of the token, defaults to the algorithm of the key.
+        :return: the public key, or None if not found.
+        :raises: JWTError if the key set cannot be refreshed, see refresh.
         """
-        issuer: str = self.get_issuer(token)
-        if issuer is not None:
-            domain = issuer
-            if not domain.startswith('http'):
-                domain = f'https://{domain}'
-
-            if not domain.endswith('/'):
-                domain = f'{domain}/'
-
-            return f'{domain}.well-known/jwks.json'
+        key = self.cache.get_key(url, kid, alg)
+        if key is not None or self.unknown_kids.get((url, kid)) is not None:
+            return key
+
+        entry = self.cache.peek(url)
+        if entry is not None and entry.expires_at > self.cache.clock():
+            # the key set is still valid, the portal may have rotated its keys
+            if not self.forced_refreshes.allow(url, current_app.config.get('HTI_JWKS_MIN_REFRESH_INTERVAL', 10)):
+                return None
+
+        entry = self.refresh(url)
+        if kid in entry.jwks:
+            return entry.get_key(kid, alg)
+        self.unknown_kids.put((url, kid), f'Unknown key (kid) {kid}',
+                              current_app.config.get('HTI_NEGATIVE_CACHE_TTL', 60),
+                              current_app.config.get('HTI_NEGATIVE_CACHE_SIZE', 1024))
         return None
 
-    @staticmethod
-    def get_issuer(token: str) -> str:
+    def refresh(self, url: str) -> JwksCacheEntry:
         """
-        Gets the issuer (iss) from the encoded token.
-        :param token: the encoded token.
-        :return: the issuer (iss) from the encoded token.
+        Fetches the key set of the URL, coalesced with the fetches of other threads. If the fetch fails, the
+        last known good key set is served for another HTI_JWKS_RETRY_AFTER seconds, as long as it has not been
+        expired for more than HTI_JWKS_MAX_STALENESS seconds.
+        :param url: the JWKS URL.
+        :return: the cache entry of the key set.
+        :raises: JWTError if the key set cannot be fetched, or the fetch of another thread did not complete within
+        HTI_JWKS_FETCH_WAIT_TIMEOUT seconds, and there is no last known good key set.
         """
-        decode = jwt.get_unverified_claims(token)
-        return decode['iss'] if 'iss' in decode else None
-
-    @staticmethod
-    def get_kid(token: str) -> str:
+        timeout = current_app.config.get('HTI_JWKS_FETCH_WAIT_TIMEOUT', 10)
+        try:
+            return self.fetches.do(url, lambda: self.fetch_jwks(url), timeout)
+        except (JWTError, TimeoutError) as error:
+            entry = self.cache.serve_stale(url, current_app.config.get('HTI_JWKS_RETRY_AFTER', 30))
+            if entry is not None:
+                current_app.logger.warning('Serving the last known good jwks of %s: %s', url, error)
+                return entry
+            if isinstance(error, TimeoutError):
+                raise JWTError(f'Timed out after {timeout} seconds waiting for the jwks at {url}') from error
+            raise
+
+    def fetch_jwks(self, url: str) -> JwksCacheEntry:
         """
-        Gets the key id (kid) from the header of the encoded token.
-        :param token: the encoded token.
-        :return: the key id (kid) from the header of the encoded token.
+        Fetches the URL, parses the JWKS json file and stores the key set in the cache. The key set
+        expires after the max-age of the Cache-Control header, or else after HTI_JWKS_CACHE_TTL seconds.
+        :param url: the JWKS URL.
+        :return: the cache entry of the key set.
+        :raises: JWTError if the jwks.json cannot be fetched or is not a valid key set.
         """
-        header = jwt.get_unverified_header(token)
-        return header['kid'] if 'kid' in header else None
+        try:
+            response = http_client.get(url)
+        except HttpError as error:
+            raise JWTError(f'Cannot fetch the jwks at {url}: {error.message}') from error
+        try:
+            data = json.loads(response.body.decode('utf8'))
+            if not isinstance(data['keys'], list):
+                raise TypeError('keys is not a list')
+            for key in data['keys']:
+                if 'alg' not in key:
+                    key['alg'] = default_algorithm(key)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            raise JWTError(f'Invalid jwks at {url}: {error!r}') from error
+        ttl = parse_max_age(response.headers.get('Cache-Control'))
+        if ttl is None:
+            ttl = current_app.config.get('HTI_JWKS_CACHE_TTL', 300)
+        ttl = min(ttl, current_app.config.get('HTI_JWKS_CACHE_MAX_TTL', 3600))
+        return self.cache.put(url, data['keys'], ttl, current_app.config.get('HTI_JWKS_CACHE_SIZE', 64),
+                              current_app.config.get('HTI_JWKS_MAX_STALENESS', 3600))
+
+
+class JwksRefresher:
+    """
+    Background job that prefetches the key sets of all allowed portals that make use of jwks discovery when
+    the application starts, and refreshes them before they expire. The refresh runs every
+    HTI_JWKS_REFRESH_INTERVAL seconds with a random jitter, so that multiple instances do not refresh in step.
+    """
 
-    @staticmethod
-    def get_jwks_by_kid(url: str, kid: str) -> dict:
+    def __init__(self, app: Flask):
+        self.app = app
+        self.ready = threading.Event()
+        self.warm_up_duration = None
+        self.refreshes = 0
+        self.failures = 0
+        self._thread = None
+
+    def start(self):
         """
-        Fetches the URL, parsed the JWKS json file and tries to find
-        the public key by its id (kid).
-        :param url: the JWKS URL.
-        :param kid: the key id (kid) to look for.
-        :return: the public key as dict.
+        Starts the background thread.
         """
-        data = json.loads(urlopen(url).read().decode('utf8'))
-        for key in data['keys']:
-            if key['kid'] == kid:
-                if 'alg' not in key:
-                    key['alg'] = ALGORITHMS.RS512
-                return key
-        return None
+        self._thread = threading.Thread(target=self._run, name='jwks-refresh', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self._refresh()
+        finally:
+            # the application is ready also when the warm up failed, the keys are then fetched on first use
+            self.warm_up_duration = time.perf_counter() - start
+            self.ready.set()
+        while True:
+            interval = self.app.config.get('HTI_JWKS_REFRESH_INTERVAL', 60)
+            time.sleep(interval * random.uniform(0.9, 1.1))
+            self._refresh()
+
+    def _refresh(self):
+        with self.app.app_context():
+            try:
+                self.refresh_expiring()
+            # pylint: disable=W0703
+            except Exception:
+                self.failures += 1
+                self.app.logger.exception('Refreshing the jwks failed')
+
+    def refresh_expiring(self):
+        """
+        Refreshes the key sets of the portals that are not cached yet, or that expire within
+        HTI_JWKS_REFRESH_AHEAD seconds.
+        """
+        registry: IssuerRegistry = self.app.extensions['hti_issuers']
+        refresh_ahead = self.app.config.get('HTI_JWKS_REFRESH_AHEAD', 120)
+        cache = jwks_discovery_service.cache
+        for portal in registry.issuers.values():
+            if portal.pinned is not None:
+                continue
+            entry = cache.peek(portal.jwks_url)
+            if entry is not None and entry.expires_at - cache.clock() > refresh_ahead:
+                continue
+            try:
+                jwks_discovery_service.refresh(portal.jwks_url)
+                self.refreshes += 1
+            except JWTError as error:
+                self.failures += 1
+                self.app.logger.warning('Refreshing the jwks of %s failed: %s', portal.issuer, error)
+
+    def stats(self) -> dict:
+        """
+        The counters of this job.
+        :return: the counters as dict.
+        """
+        return {'ready': self.ready.is_set(),
+                'warm_up_duration': self.warm_up_duration,
+                'refreshes': self.refreshes,
+                'failures': self.failures}
 
 
 class JwtModelService:
@@ -183,28 +342,151 @@ class JwtModelService:
     """
 
     @staticmethod
-    def exists_jti(jti):
+    def register_jti(jti, exp: int = None) -> bool:
         """
-        Checks if the JWT Id (JTI) exists in the datastore.
-        :param jti:
-        :return: True if the JTI exists.
+        Stores a JWT Id (JTI) in the datastore with a single insert. The primary key constraint rejects
+        a JTI that has been stored before, also when two requests with the same JTI race each other.
+        :param jti: the JWT Id (JTI)
+        :param exp: the expiration time (exp) of the token, in seconds since the epoch.
+        :return: True if the JTI was stored, False if the JTI already exists.
         """
         with current_app.app_context():
-            return JwtId.query.filter_by(id=jti).count() > 0
+            try:
+                db.session.execute(JwtId.__table__.insert().values(id=jti, exp=exp))
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                return False
+            return True
 
     @staticmethod
-    def store_jti(jti):
+    def count_jti() -> int:
         """
-        Stores a JWT Id (JTI) in the datastore.
-        :param jti: the JWT Id (JTI)
+        Counts the JWT Ids (JTI) in the datastore.
+        :return: the number of JTIs.
+        """
+        with current_app.app_context():
+            return db.session.query(db.func.count(JwtId.id)).scalar()
+
+    @staticmethod
+    def stamp_jti(exp: int, batch_size: int) -> int:
+        """
+        Sets the expiration time of the JWT Ids (JTI) without one, the JTIs stored before the exp column was
+        added, so that these are purged like the other JTIs. The JTIs are updated in batches.
+        :param exp: the expiration time to set, in seconds since the epoch.
+        :param batch_size: the maximum number of JTIs to update per transaction.
+        :return: the number of updated JTIs.
+        """
+        stamped = 0
+        with current_app.app_context():
+            while True:
+                ids = [row.id for row in db.session.query(JwtId.id).filter(JwtId.exp.is_(None)).limit(batch_size)]
+                if not ids:
+                    break
+                db.session.execute(JwtId.__table__.update().where(JwtId.id.in_(ids)).values(exp=exp))
+                db.session.commit()
+                stamped += len(ids)
+                if len(ids) < batch_size:
+                    break
+        return stamped
+
+    @staticmethod
+    def purge_jti(cutoff: int, batch_size: int) -> int:
         """
+        Deletes the JWT Ids (JTI) that expired before the cutoff. The JTIs are selected by the exp index and
+        deleted by primary key in batches, each batch in its own short transaction.
+        :param cutoff: the cutoff in seconds since the epoch.
+        :param batch_size: the maximum number of JTIs to delete per transaction.
+        :return: the number of deleted JTIs.
+        """
+        purged = 0
         with current_app.app_context():
-            jwt_id = JwtId(id=jti)
-            db.session.add(jwt_id)
-            db.session.commit()
+            while True:
+                ids = [row.id for row in db.session.query(JwtId.id).filter(JwtId.exp < cutoff).limit(batch_size)]
+                if not ids:
+                    break
+                db.session.execute(JwtId.__table__.delete().where(JwtId.id.in_(ids)))
+                db.session.commit()
+                purged += len(ids)
+                if len(ids) < batch_size:
+                    break
+        return purged
+
+
+class JtiPurgeJob:
+    """
+    Background job that purges the JWT Ids (JTI) once they are past their expiration time plus the
+    HTI_JTI_CLOCK_SKEW margin, a token that old is rejected on its exp claim anyway. The JTIs without expiration
+    time are given the time of the run that finds them, these are purged by a later run.
+
+    Each run counts the JTIs once afterwards, so that the size of the table is known without a count per request.
+    """
+
+    def __init__(self):
+        self.size = None
+        self.runs = 0
+        self.purged = 0
+        self.last_purged = 0
+        self.last_duration = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, app: Flask):
+        """
+        Starts the background thread, if HTI_JTI_PURGE_INTERVAL is set and the thread is not running yet.
+        :param app: the Flask application instance.
+        """
+        interval = app.config.get('HTI_JTI_PURGE_INTERVAL', 0)
+        with self._lock:
+            if interval <= 0 or self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(app, interval), name='jti-purge', daemon=True)
+            self._thread.start()
+
+    def _run(self, app: Flask, interval: int):
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    self.run()
+                # pylint: disable=W0703
+                except Exception:
+                    app.logger.exception('Purging the expired JWT Ids failed')
+
+    def run(self) -> int:
+        """
+        Purges the expired JWT Ids (JTI).
+        :return: the number of deleted JTIs.
+        """
+        start = time.perf_counter()
+        now = int(time.time())
+        batch_size = current_app.config.get('HTI_JTI_PURGE_BATCH_SIZE', 1000)
+        purged = jwt_model_service.purge_jti(now - current_app.config.get('HTI_JTI_CLOCK_SKEW', 300), batch_size)
+        jwt_model_service.stamp_jti(now, batch_size)
+        size = jwt_model_service.count_jti()
+        with self._lock:
+            self.size = size
+            self.runs += 1
+            self.purged += purged
+            self.last_purged = purged
+            self.last_duration = time.perf_counter() - start
+        return purged
+
+    def stats(self) -> dict:
+        """
+        The counters of this job.
+        :return: the counters as dict.
+        """
+        with self._lock:
+            return {'size': self.size,
+                    'runs': self.runs,
+                    'purged': self.purged,
+                    'last_purged': self.last_purged,
+                    'last_duration': self.last_duration}
 
 
 hti_launch_service = HtiLaunchService()
 hti_portal_service = HtiPortalService()
 jwks_discovery_service = JwksDiscoveryService()
 jwt_model_service = JwtModelService()
+jti_purge_job = JtiPurgeJob()
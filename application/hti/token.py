@@ -0,0 +1,99 @@
+"""
+The parsed representation of the HTI launch token.
+"""
+import binascii
+import json
+import typing
+from collections.abc import Mapping
+
+from jose import jwt
+from jose.backends.base import Key
+from jose.exceptions import JWTError
+from jose.utils import base64url_decode
+
+# The python-jose defaults of jwt.decode, the options of the launch are applied on top of these.
+JWT_DEFAULT_OPTIONS = {
+    'verify_signature': True,
+    'verify_aud': True,
+    'verify_iat': True,
+    'verify_exp': True,
+    'verify_nbf': True,
+    'verify_iss': True,
+    'verify_sub': True,
+    'verify_jti': True,
+    'verify_at_hash': True,
+    'leeway': 0}
+
+
+class ParsedToken:
+    """
+    A JWT that is split and decoded exactly once. The header and claims are available before the
+    signature is verified, the claims must not be trusted before the verify method has succeeded.
+    """
+    __slots__ = ('token', 'header', 'claims', 'signing_input', 'signature')
+
+    def __init__(self, token: str):
+        """
+        Splits and decodes the token.
+        :param token: the encoded token.
+        :raises: JWTError if the token is malformed.
+        """
+        self.token = token
+        try:
+            self.signing_input, crypto_segment = token.encode('utf-8').rsplit(b'.', 1)
+            header_segment, claims_segment = self.signing_input.split(b'.', 1)
+            self.header = json.loads(base64url_decode(header_segment).decode('utf-8'))
+            self.claims = json.loads(base64url_decode(claims_segment).decode('utf-8'))
+            self.signature = base64url_decode(crypto_segment)
+        except (AttributeError, ValueError, TypeError, binascii.Error) as error:
+            raise JWTError(f'Invalid token: {error}') from error
+        if not isinstance(self.header, Mapping) or not isinstance(self.claims, Mapping):
+            raise JWTError('Invalid token: the header and payload must be json objects')
+
+    @property
+    def issuer(self) -> typing.Optional[str]:
+        """
+        The unverified issuer (iss) of the token.
+        """
+        return self.claims.get('iss')
+
+    @property
+    def kid(self) -> typing.Optional[str]:
+        """
+        The key id (kid) from the header of the token.
+        """
+        return self.header.get('kid')
+
+    @property
+    def alg(self) -> typing.Optional[str]:
+        """
+        The algorithm (alg) from the header of the token.
+        """
+        return self.header.get('alg')
+
+    def verify(self, key: Key, options: dict, audience: str, issuer: str) -> dict:
+        """
+        Verifies the signature of the token with the key and validates the claims, like jwt.decode
+        does, without decoding the token again.
+        :param key: the public key of the issuer.
+        :param options: the validation options, see jwt.decode.
+        :param audience: the expected audience (aud).
+        :param issuer: the expected issuer (iss).
+        :return: the verified claims.
+        :raises: JWTError if the signature is invalid, JWTClaimsError if a claim is invalid.
+        """
+        if not self.alg:
+            raise JWTError('No algorithm was specified in the JWS header.')
+        try:
+            valid = key.verify(self.signing_input, self.signature)
+        # pylint: disable=W0703
+        except Exception:
+            valid = False
+        if not valid:
+            raise JWTError('Signature verification failed.')
+        # _validate_claims is private to python-jose, this relies on the python-jose==3.4.0 pin of requirements.txt.
+        # Check test_verify_claims of tests/test_token.py when upgrading python-jose.
+        # pylint: disable=W0212
+        jwt._validate_claims(self.claims, audience=audience, issuer=issuer, algorithm=self.alg,
+                             options=dict(JWT_DEFAULT_OPTIONS, **options))
+        return self.claims
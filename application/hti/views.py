@@ -1,7 +1,7 @@
 """
 The view objects for this module.
 """
-from flask import Blueprint, session, redirect, request, abort
+from flask import Blueprint, current_app, session, redirect, request, abort
 from flask_classful import FlaskView, route
 
 from application.hti.services import hti_launch_service
@@ -30,10 +30,13 @@ def create_blueprint() -> Blueprint:
             """
             if 'token' in request.values:
                 token = request.values['token']
-                task = hti_launch_service.launch(token, request.host)
-                if task is None:
+                if len(token) > current_app.config.get('HTI_MAX_TOKEN_LENGTH', 16384):
+                    abort(400, 'Bad Request, the token is too long')
+                context = hti_launch_service.launch(token, request.host)
+                if context is None:
                     abort(403, "Forbidden")
-                session['task'] = task
+                session.regenerate()
+                session['launch'] = context
 
                 return redirect('index.html')
 
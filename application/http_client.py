@@ -0,0 +1,251 @@
+"""
+The HTTP client for outbound calls of this application, like the jwks discovery. The client keeps
+persistent connections per host, so that repeated calls do not pay for a new TCP and TLS handshake,
+and bounds every call with timeouts, an overall deadline, a maximum response size and a limited number of retries.
+Redirects are not followed, a 3xx response fails like any other non 2xx response.
+"""
+import http.client
+import ssl
+import threading
+import time
+import typing
+from urllib.parse import urlsplit
+
+from flask import Config
+
+# The errors of a reused keep-alive connection that the portal closed while it was idle. These are retried on a new
+# connection right away, other errors, like a read timeout, count as a failed attempt.
+STALE_CONNECTION_ERRORS = (ConnectionError, http.client.RemoteDisconnected, ssl.SSLEOFError, ssl.SSLZeroReturnError)
+CHUNK_SIZE = 65536
+
+
+class HttpError(Exception):
+    """
+    Error state for failed outbound calls.
+    """
+
+    def __init__(self, message, status_code=None):
+        Exception.__init__(self, message)
+        self.message = message
+        self.status_code = status_code
+
+
+class HttpResponse:  # pylint: disable=R0903
+    """
+    A completely read response.
+    """
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status: int, headers: typing.Mapping[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def read(self) -> bytes:
+        """
+        The body of the response.
+        :return: the body as bytes.
+        """
+        return self.body
+
+
+class HttpClient:  # pylint: disable=R0902
+    """
+    A thread safe HTTP client with a pool of keep-alive connections per scheme, host and port.
+    """
+
+    def __init__(self, connect_timeout: float = 2.0, read_timeout: float = 5.0,  # pylint: disable=R0913
+                 deadline: float = 10.0, max_response_size: int = 1048576, retries: int = 2,
+                 retry_backoff: float = 0.1, pool_size: int = 4, ssl_context: ssl.SSLContext = None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.max_response_size = max_response_size
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.pool_size = pool_size
+        self.ssl_context = ssl_context
+        self.connections = 0
+        self.requests = 0
+        self.reused = 0
+        self.failures = 0
+        self._pools: typing.Dict[tuple, typing.List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config: Config):
+        """
+        Applies the HTTP_* settings of the application configuration.
+        :param config: the application configuration.
+        """
+        self.connect_timeout = config.get('HTTP_CONNECT_TIMEOUT', self.connect_timeout)
+        self.read_timeout = config.get('HTTP_READ_TIMEOUT', self.read_timeout)
+        self.deadline = config.get('HTTP_DEADLINE', self.deadline)
+        self.max_response_size = config.get('HTTP_MAX_RESPONSE_SIZE', self.max_response_size)
+        self.retries = config.get('HTTP_RETRIES', self.retries)
+        self.retry_backoff = config.get('HTTP_RETRY_BACKOFF', self.retry_backoff)
+        self.pool_size = config.get('HTTP_POOL_SIZE', self.pool_size)
+
+    def get(self, url: str, headers: typing.Mapping[str, str] = None) -> HttpResponse:
+        """
+        Performs a GET request. Connection errors and 5xx responses are retried with exponential backoff, all attempts
+        together are bounded by the deadline of the client.
+        :param url: the URL.
+        :param headers: optional request headers.
+        :return: the response.
+        :raises: HttpError if the request failed, the response status is not 2xx, the response is too large or the
+        deadline passed.
+        """
+        origin, path = self._split(url)
+        request_headers = {'Accept': 'application/json', 'Connection': 'keep-alive'}
+        request_headers.update(headers or {})
+
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            connection, reused = None, False
+            try:
+                connection, reused = self._acquire(origin, deadline)
+                response, keep_alive = self._request(connection, path, request_headers, deadline)
+            except (OSError, http.client.HTTPException) as error:
+                if connection is not None:
+                    connection.close()
+                if reused and isinstance(error, STALE_CONNECTION_ERRORS):
+                    # The portal may have closed an idle keep-alive connection, retry on a new connection.
+                    continue
+                failure = HttpError(f'GET {url} failed: {error}')
+            else:
+                if response.status < 500:
+                    self._release(origin, connection, keep_alive)
+                    if response.status >= 300:
+                        raise HttpError(f'GET {url} returned {response.status}', response.status)
+                    return response
+                connection.close()
+                failure = HttpError(f'GET {url} returned {response.status}', response.status)
+
+            with self._lock:
+                self.failures += 1
+            backoff = self.retry_backoff * (2 ** attempt)
+            if attempt >= self.retries or time.monotonic() + backoff >= deadline:
+                raise failure
+            time.sleep(backoff)
+            attempt += 1
+
+    @staticmethod
+    def _split(url: str) -> (tuple, str):
+        """
+        Splits the URL in the origin of the connection pool and the path of the request.
+        :return: the origin (scheme, host and port) and the path with the query.
+        :raises: HttpError if the scheme is not http or https.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise HttpError(f'Unsupported URL {url}')
+        path = parts.path or '/'
+        if parts.query:
+            path = f'{path}?{parts.query}'
+        return (parts.scheme, parts.hostname, parts.port), path
+
+    def _request(self, connection: http.client.HTTPConnection, path: str, headers: typing.Mapping[str, str],
+                 deadline: float) -> (HttpResponse, bool):
+        """
+        Performs the request on the connection and reads the response, with a maximum of max_response_size bytes. Every
+        socket read waits at most read_timeout seconds and never past the deadline.
+        :return: the response and whether the connection can be kept alive.
+        """
+        try:
+            self._settimeout(connection, path, deadline)
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            length = response.getheader('Content-Length')
+            if length is not None and int(length) > self.max_response_size:
+                raise HttpError(f'The response of {path} exceeds {self.max_response_size} bytes')
+            chunks, size = [], 0
+            while size <= self.max_response_size:
+                self._settimeout(connection, path, deadline)
+                chunk = response.read1(min(CHUNK_SIZE, self.max_response_size + 1 - size))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+            if size > self.max_response_size:
+                raise HttpError(f'The response of {path} exceeds {self.max_response_size} bytes')
+            # the body is complete, release the response so that the connection accepts the next request
+            response.close()
+        except ValueError as error:
+            connection.close()
+            raise HttpError(f'The response of {path} has an invalid Content-Length') from error
+        except HttpError:
+            connection.close()
+            raise
+        return HttpResponse(response.status, response.headers, b''.join(chunks)), not response.will_close
+
+    def _settimeout(self, connection: http.client.HTTPConnection, path: str, deadline: float):
+        """
+        Limits the next socket operation on the connection to read_timeout, or to the time left until the deadline.
+        :raises: HttpError if the deadline passed.
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise HttpError(f'GET {path} exceeded the deadline of {self.deadline} seconds')
+        connection.sock.settimeout(min(self.read_timeout, remaining))
+
+    def _acquire(self, origin: tuple, deadline: float) -> (http.client.HTTPConnection, bool):
+        """
+        Takes an idle connection from the pool of the origin, or opens a new connection.
+        :return: the connection and whether it was reused.
+        """
+        with self._lock:
+            self.requests += 1
+            pool = self._pools.get(origin)
+            if pool:
+                self.reused += 1
+                return pool.pop(), True
+            self.connections += 1
+
+        scheme, host, port = origin
+        timeout = max(min(self.connect_timeout, deadline - time.monotonic()), 0.001)
+        if scheme == 'https':
+            connection = http.client.HTTPSConnection(host, port, timeout=timeout, context=self.ssl_context)
+        else:
+            connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        connection.connect()
+        return connection, False
+
+    def _release(self, origin: tuple, connection: http.client.HTTPConnection, keep_alive: bool):
+        """
+        Returns the connection to the pool of the origin, if the connection can be kept alive.
+        """
+        if not keep_alive:
+            connection.close()
+            return
+        with self._lock:
+            pool = self._pools.setdefault(origin, [])
+            if len(pool) < self.pool_size:
+                pool.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            for connection in pool:
+                connection.close()
+
+    def stats(self) -> dict:
+        """
+        The counters of this client.
+        :return: the counters as dict.
+        """
+        with self._lock:
+            return {'idle': sum(len(pool) for pool in self._pools.values()),
+                    'connections': self.connections,
+                    'requests': self.requests,
+                    'reused': self.reused,
+                    'failures': self.failures}
+
+
+http_client = HttpClient()
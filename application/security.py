@@ -37,7 +37,7 @@ def require_session_json(function):
     """
 
     def wrapper(*args, **kwargs):
-        if session.get('task') is None:
+        if session.get('launch') is None:
             raise AccessDenied('Forbidden', 403)
 
         return function(*args, **kwargs)
@@ -53,7 +53,7 @@ def require_session_html(function):
     """
 
     def wrapper(*args, **kwargs):
-        if session.get('task') is None:
+        if session.get('launch') is None:
             return abort(403, 'Forbidden')
 
         return function(*args, **kwargs)
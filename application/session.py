@@ -0,0 +1,275 @@
+"""
+Server side sessions. The session data, like the FHIR Task of the launch, is kept in a session store, the
+session cookie only carries an opaque, random session id. The in memory store is a LRU cache with a time to
+live, the SQL store shares the sessions between processes and containers.
+"""
+import json
+import secrets
+import threading
+import time
+import typing
+from collections import OrderedDict
+
+from flask import Config, Flask, Request, Response
+from flask.sessions import SecureCookieSession, SessionInterface
+from sqlalchemy.exc import IntegrityError
+
+from application.database import db
+
+
+# pylint: disable=C0103
+class SessionData(db.Model):  # pylint: disable=R0903
+    """
+    A server side session of the SQL session store, the data is stored as JSON.
+    """
+    __tablename__ = 'session_data'
+    id = db.Column(db.String(64), primary_key=True, autoincrement=False)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.BigInteger, index=True, nullable=False)
+
+
+class ServerSession(SecureCookieSession):
+    """
+    The session of a request, identified by the session id (sid) in the session cookie.
+    """
+
+    def __init__(self, initial: dict = None, sid: str = None):
+        SecureCookieSession.__init__(self, initial)
+        self.sid = sid
+        self.previous_sid = None
+
+    def regenerate(self):
+        """
+        Issues a new session id on save and removes the session of the old id, to call on login so that
+        a session id that was known before the login cannot be used afterwards.
+        """
+        if self.sid is not None and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class MemorySessionStore:  # pylint: disable=R0902
+    """
+    Thread safe in process session store, the least recently used sessions are evicted beyond max_size. Each read
+    extends the time to live of the session.
+    """
+
+    def __init__(self, max_size: int, clock: typing.Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: 'OrderedDict[str, typing.Tuple[dict, float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid: str, ttl: float = None) -> typing.Optional[dict]:
+        """
+        Looks up the session data.
+        :param sid: the session id.
+        :param ttl: the time to live in seconds from now, the expiration time is unchanged if None.
+        :return: a copy of the session data, or None if not found or expired.
+        """
+        with self._lock:
+            now = self.clock()
+            entry = self._entries.get(sid)
+            if entry is not None and entry[1] <= now:
+                del self._entries[sid]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            if ttl is not None:
+                self._entries[sid] = (entry[0], now + ttl)
+            self._entries.move_to_end(sid)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, sid: str, data: dict, ttl: float):
+        """
+        Stores the session data.
+        :param sid: the session id.
+        :param data: the session data.
+        :param ttl: the time to live in seconds.
+        """
+        with self._lock:
+            self._entries[sid] = (dict(data), self.clock() + ttl)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, sid: str):
+        """
+        Removes the session data.
+        :param sid: the session id.
+        """
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def stats(self) -> dict:
+        """
+        The counters of this store.
+        :return: the counters as dict.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'store': 'memory',
+                    'size': len(self._entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else None,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations}
+
+
+class SqlSessionStore:
+    """
+    Session store in the application database, the expired sessions are deleted at most once per purge_interval.
+    A read extends the time to live of the session once less than half of it remains, so that an active session
+    takes at most two updates per time to live.
+    """
+
+    def __init__(self, purge_interval: float = 300, clock: typing.Callable[[], float] = time.time):
+        self.purge_interval = purge_interval
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self._purged_at = clock()
+        self._lock = threading.Lock()
+
+    def get(self, sid: str, ttl: float = None) -> typing.Optional[dict]:
+        """
+        Looks up the session data.
+        :param sid: the session id.
+        :param ttl: the time to live in seconds from now, the expiration time is unchanged if None.
+        :return: the session data, or None if not found or expired.
+        """
+        now = self.clock()
+        row = db.session.execute(db.select([SessionData.data, SessionData.expires_at]).where(SessionData.id == sid)
+                                 .where(SessionData.expires_at > int(now))).first()
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if ttl is not None and row[1] - now < ttl / 2:
+            table = SessionData.__table__
+            db.session.execute(table.update().where(table.c.id == sid).values(expires_at=int(now + ttl)))
+            db.session.commit()
+        return json.loads(row[0])
+
+    def put(self, sid: str, data: dict, ttl: float):
+        """
+        Stores the session data, and deletes the expired sessions when the purge interval has passed.
+        :param sid: the session id.
+        :param data: the session data.
+        :param ttl: the time to live in seconds.
+        """
+        now = self.clock()
+        values = {'data': json.dumps(data), 'expires_at': int(now + ttl)}
+        table = SessionData.__table__
+        updated = db.session.execute(table.update().where(table.c.id == sid).values(**values)).rowcount
+        if not updated:
+            try:
+                db.session.execute(table.insert().values(id=sid, **values))
+            except IntegrityError:
+                db.session.rollback()
+                db.session.execute(table.update().where(table.c.id == sid).values(**values))
+        with self._lock:
+            purge = now - self._purged_at >= self.purge_interval
+            if purge:
+                self._purged_at = now
+        if purge:
+            deleted = db.session.execute(table.delete().where(table.c.expires_at <= int(now))).rowcount
+            with self._lock:
+                self.expirations += deleted
+        db.session.commit()
+
+    def delete(self, sid: str):
+        """
+        Removes the session data.
+        :param sid: the session id.
+        """
+        table = SessionData.__table__
+        db.session.execute(table.delete().where(table.c.id == sid))
+        db.session.commit()
+
+    def stats(self) -> dict:
+        """
+        The counters of this store.
+        :return: the counters as dict.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'store': 'sql',
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else None,
+                    'expirations': self.expirations}
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    The session interface that keeps the session data in the session store, with the session id in the cookie.
+    """
+
+    def __init__(self, store: typing.Union[MemorySessionStore, SqlSessionStore], ttl: float):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app: Flask, request: Request) -> ServerSession:
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid:
+            data = self.store.get(sid, self.ttl)
+            if data is not None:
+                return ServerSession(data, sid)
+        return ServerSession()
+
+    def save_session(self, app: Flask, session: ServerSession, response: Response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            session.previous_sid = None
+
+        if not session:
+            if session.modified and session.sid is not None:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            if session.sid is None:
+                session.sid = secrets.token_urlsafe(32)
+            self.store.put(session.sid, dict(session), self.ttl)
+        elif not self.should_set_cookie(app, session):
+            return
+
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain,
+                            path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'ServerSessionInterface':
+        """
+        Creates the session interface with the store of SESSION_STORE, either memory or sql.
+        :param config: the application configuration.
+        :return: the session interface.
+        """
+        store_type = config.get('SESSION_STORE', 'memory')
+        if store_type == 'memory':
+            store = MemorySessionStore(config.get('SESSION_CACHE_SIZE', 10000))
+        elif store_type == 'sql':
+            store = SqlSessionStore(config.get('SESSION_PURGE_INTERVAL', 300))
+        else:
+            raise ValueError(f'Unknown SESSION_STORE {store_type}, expected memory or sql')
+        return cls(store, config.get('SESSION_TTL', 3600))
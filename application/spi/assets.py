@@ -0,0 +1,250 @@
+"""
+The static asset pipeline of the single page interface (spi). The build step writes a content hashed copy of every
+css and js file to the dist folder, with gzip and brotli compressed variants, and an index.html that refers to the
+hashed names. The hashed assets never change, so that they are served with a one year immutable cache lifetime.
+Brotli is a requirement, without it the build skips the brotli variants and the assets are served with gzip.
+The StaticBundle optionally keeps all static files in memory.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+import typing
+from types import MappingProxyType
+
+from flask import Response, current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+ASSET_FOLDERS = ('css', 'js')
+
+# The encodings of the precompressed variants, in order of preference, with the suffix of the variant.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+_REFERENCE = re.compile(r'''(?P<attribute>(?:href|src)=["'])(?P<path>(?:css|js)/[^"'?#]+)(?:\?[^"'#]*)?(?=["'])''')
+
+
+def fingerprint(path: str, content: bytes) -> str:
+    """
+    Inserts the content hash in the file name: css/styles.css becomes css/styles.<hash>.css
+    :param path: the path of the asset.
+    :param content: the content of the asset.
+    :return: the fingerprinted path.
+    """
+    root, extension = os.path.splitext(path)
+    return f'{root}.{hashlib.blake2b(content, digest_size=8).hexdigest()}{extension}'
+
+
+def rewrite_references(html: str, manifest: typing.Mapping[str, str]) -> str:
+    """
+    Replaces the references to the assets in the html with their fingerprinted paths, dropping the version
+    query strings.
+    :param html: the html.
+    :param manifest: the fingerprinted paths by original path.
+    :return: the rewritten html.
+    """
+    def replace(match):
+        path = match.group('path')
+        if path not in manifest:
+            return match.group(0)
+        return f'{match.group("attribute")}{manifest[path]}'
+
+    return _REFERENCE.sub(replace, html)
+
+
+def _write(path: str, content: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+def build_assets(static_folder: str) -> typing.Dict[str, str]:
+    """
+    Builds the dist folder of the static folder: the fingerprinted assets with their compressed variants,
+    the rewritten index.html and the manifest.
+    :param static_folder: the static folder of the spi blueprint.
+    :return: the manifest, the fingerprinted paths by original path.
+    """
+    dist_folder = os.path.join(static_folder, DIST)
+    manifest = {}
+    for folder in ASSET_FOLDERS:
+        for name in sorted(os.listdir(os.path.join(static_folder, folder))):
+            path = f'{folder}/{name}'
+            with open(os.path.join(static_folder, path), 'rb') as file:
+                content = file.read()
+            manifest[path] = fingerprint(path, content)
+            target = os.path.join(dist_folder, manifest[path])
+            _write(target, content)
+            _write(f'{target}.gz', gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write(f'{target}.br', brotli.compress(content, quality=11))
+
+    with open(os.path.join(static_folder, 'index.html'), 'rt', encoding='utf8') as file:
+        index = rewrite_references(file.read(), manifest)
+    _write(os.path.join(dist_folder, 'index.html'), index.encode('utf8'))
+    _write(os.path.join(dist_folder, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf8'))
+    return manifest
+
+
+def load_manifest(static_folder: str) -> typing.Optional[typing.Dict[str, str]]:
+    """
+    Loads the manifest of the dist folder.
+    :param static_folder: the static folder of the spi blueprint.
+    :return: the fingerprinted paths by original path, or None if the assets have not been built.
+    """
+    try:
+        with open(os.path.join(static_folder, DIST, MANIFEST), 'rt', encoding='utf8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def negotiate(path: str, accept_encodings, exists: typing.Callable[[str], bool]) -> \
+        typing.Tuple[str, typing.Optional[str]]:
+    """
+    Selects the precompressed variant of a fingerprinted asset that the client accepts.
+    :param path: the path of the asset.
+    :param accept_encodings: the parsed Accept-Encoding header of the request.
+    :param exists: checks if a variant exists.
+    :return: the path of the variant to send and its Content-Encoding, None for the uncompressed asset.
+    """
+    for encoding, suffix in ENCODINGS:
+        if accept_encodings[encoding] and exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+class StaticFile:  # pylint: disable=R0903
+    """
+    A static file in memory, with the ETag and mimetype computed once.
+    """
+    __slots__ = ('body', 'etag', 'mimetype', 'version')
+
+    def __init__(self, body: bytes, mimetype: str, version: typing.Tuple[int, int]):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.mimetype = mimetype
+        self.version = version
+
+    def response(self, status: int = 200, mimetype: str = None) -> Response:
+        """
+        Creates a response with the body of the file, conditional to If-None-Match for a 200 response.
+        :param status: the status of the response.
+        :param mimetype: the mimetype, overrides the mimetype of the file, e.g. for a compressed variant.
+        :return: the response.
+        """
+        response = current_app.response_class(self.body, status, mimetype=mimetype or self.mimetype)
+        response.set_etag(self.etag)
+        if status == 200:
+            response.make_conditional(request)
+        return response
+
+
+def _mimetype(path: str) -> str:
+    for _, suffix in ENCODINGS:
+        if path.endswith(suffix):
+            return 'application/octet-stream'
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+class StaticBundle:
+    """
+    The static files of the spi blueprint, preloaded in memory so that serving them takes no file system calls.
+    The files are checked for changes at most once per check interval, by modification time and size, and the
+    changed files are reloaded. Until the bundle is loaded, get returns None and the files are sent from disk.
+    """
+
+    def __init__(self, static_folder: str):
+        self.static_folder = static_folder
+        self.check_interval = 2.0
+        self.checks = 0
+        self.reloads = 0
+        self._files: typing.Optional[typing.Mapping[str, StaticFile]] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        """
+        True if the bundle has been loaded.
+        """
+        return self._files is not None
+
+    def load(self, check_interval: float = 2.0):
+        """
+        Loads all files of the static folder.
+        :param check_interval: the minimum number of seconds between two checks for changed files.
+        """
+        self.check_interval = check_interval
+        with self._lock:
+            self._reload({})
+            self._next_check = time.monotonic() + check_interval
+
+    def get(self, path: str) -> typing.Optional[StaticFile]:
+        """
+        Gets a file, the files are checked for changes when the check interval has passed.
+        :param path: the path of the file, relative to the static folder.
+        :return: the file, or None if the bundle has not been loaded or the file does not exist.
+        """
+        files = self._files
+        if files is None:
+            return None
+        if time.monotonic() >= self._next_check and self._lock.acquire(blocking=False):  # pylint: disable=R1732
+            # a single request checks the files, the other requests continue with the current files
+            try:
+                self._next_check = time.monotonic() + self.check_interval
+                self.checks += 1
+                files = self._reload(files)
+            finally:
+                self._lock.release()
+        return files.get(path)
+
+    def _reload(self, files: typing.Mapping[str, StaticFile]) -> typing.Mapping[str, StaticFile]:
+        """
+        Loads the files that are new or changed and swaps in the new files.
+        :return: the current files.
+        """
+        versions = {}
+        for directory, _, names in os.walk(self.static_folder):
+            for name in names:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                versions[os.path.relpath(path, self.static_folder).replace(os.sep, '/')] = (stat.st_mtime_ns,
+                                                                                            stat.st_size)
+        if self._files is not None and versions == {path: file.version for path, file in files.items()}:
+            return files
+
+        loaded = {}
+        for path, version in versions.items():
+            current = files.get(path)
+            if current is not None and current.version == version:
+                loaded[path] = current
+                continue
+            with open(os.path.join(self.static_folder, path), 'rb') as file:
+                loaded[path] = StaticFile(file.read(), _mimetype(path), version)
+        self._files = MappingProxyType(loaded)
+        self.reloads += 1
+        return self._files
+
+    def stats(self) -> dict:
+        """
+        The size and counters of this bundle.
+        :return: the counters as dict.
+        """
+        files = self._files or {}
+        return {'loaded': self._files is not None,
+                'files': len(files),
+                'bytes': sum(len(file.body) for file in files.values()),
+                'checks': self.checks,
+                'reloads': self.reloads}
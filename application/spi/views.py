@@ -1,18 +1,66 @@
 """
 The views module for the single page interface (spi).
 """
-from flask import Blueprint, redirect, send_from_directory
+import mimetypes
+import os
+
+from flask import Blueprint, current_app, redirect, request, send_from_directory
 
 # pylint: disable=W0612
 from application.security import require_session_html
+from application.spi.assets import DIST, IMMUTABLE, StaticBundle, load_manifest, negotiate
 
 
-def create_blueprint() -> Blueprint:
+def create_blueprint(static_folder: str = 'static') -> Blueprint:
     """
     Blueprint init method.
+    :param static_folder: the folder of the static files, relative to this package or absolute.
     :return: the Blueprint instance
     """
-    blueprint = Blueprint(__name__.split('.')[-2], __name__, static_folder='static')
+    blueprint = Blueprint(__name__.split('.')[-2], __name__, static_folder=static_folder)
+    manifest = load_manifest(blueprint.static_folder) or {}
+    fingerprinted = set(manifest.values())
+    bundle = StaticBundle(blueprint.static_folder)
+
+    def exists(path: str) -> bool:
+        if bundle.loaded:
+            return bundle.get(path) is not None
+        return os.path.exists(os.path.join(blueprint.static_folder, path))
+
+    def send(path: str, status: int = 200, mimetype: str = None):
+        """
+        Sends a static file, from memory if the bundle has been loaded, else from disk.
+        :param path: the path of the file, relative to the static folder.
+        :param status: the status of the response.
+        :param mimetype: the mimetype, overrides the mimetype of the file.
+        :return: the response.
+        """
+        static_file = bundle.get(path)
+        if static_file is not None:
+            response = static_file.response(status, mimetype)
+            response.cache_control.public = True
+            response.cache_control.max_age = current_app.get_send_file_max_age(path)
+            return response
+        response = send_from_directory(blueprint.static_folder, path, mimetype=mimetype)
+        response.status_code = status
+        return response
+
+    def send_asset(path: str):
+        """
+        Sends a fingerprinted asset from the dist folder, precompressed if the client accepts it, with an
+        immutable cache lifetime. Other assets are sent from the static folder.
+        :param path: the path of the asset.
+        :return: the asset.
+        """
+        if path not in fingerprinted:
+            return send(path)
+        variant, encoding = negotiate(f'{DIST}/{path}', request.accept_encodings, exists)
+        response = send(variant, mimetype=mimetypes.guess_type(path)[0])
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        return response
 
     @blueprint.route('/')
     def root():
@@ -26,10 +74,12 @@ def create_blueprint() -> Blueprint:
     @require_session_html
     def index():
         """
-        The index page.
+        The index page, revalidated on every load, so that a new build is picked up right away.
         :return: the index page.
         """
-        return blueprint.send_static_file('index.html')
+        response = send(f'{DIST}/index.html' if manifest else 'index.html')
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
 
     @blueprint.route('/<int:code>.html')
     def error(code):
@@ -37,7 +87,7 @@ def create_blueprint() -> Blueprint:
         The index page.
         :return: the index page.
         """
-        return blueprint.send_static_file(f'{code}.html'), code
+        return send(f'{code}.html', code)
 
     @blueprint.route('/css/<path:path>')
     def css(path):
@@ -46,7 +96,7 @@ def create_blueprint() -> Blueprint:
         :param path: the sub path of /css
         :return: the css file in /css
         """
-        return send_from_directory(blueprint.static_folder, 'css/' + path)
+        return send_asset('css/' + path)
 
     @blueprint.route('/js/<path:path>')
     def javascript(path):
@@ -55,7 +105,8 @@ def create_blueprint() -> Blueprint:
         :param path: the sub path of /js
         :return: the javascript files in /js
         """
-        return send_from_directory(blueprint.static_folder, 'js/' + path)
+        return send_asset('js/' + path)
 
     blueprint.error = error
+    blueprint.static_bundle = bundle
     return blueprint
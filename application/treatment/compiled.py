@@ -0,0 +1,117 @@
+"""
+The compiled treatments: a JSON snapshot of the parsed and validated treatments file, keyed by the SHA-256 hash of
+the YAML content. Loading the snapshot is a lot cheaper than parsing the YAML, the snapshot is rebuilt when the hash
+of the treatments file no longer matches. Build the snapshot at image build time with compile_treatments.py.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import typing
+
+import yaml
+from yaml import BaseLoader
+
+# The LibYAML based loader, if PyYAML was built with LibYAML, else the pure Python loader.
+YAML_LOADER = getattr(yaml, 'CBaseLoader', BaseLoader)  # pylint: disable=C0103
+
+SNAPSHOT_VERSION = 1
+
+
+def parse_treatments(document: typing.Any) -> typing.List[dict]:
+    """
+    Validates the parsed YAML document of the treatments.
+    :param document: the parsed document.
+    :return: the treatments.
+    :raises: ValueError if the document is not a valid list of treatments.
+    """
+    if not isinstance(document, dict) or not isinstance(document.get('treatments'), list):
+        raise ValueError('The treatments file must contain a treatments list')
+    for treatment in document['treatments']:
+        if not isinstance(treatment, dict) or not {'id', 'name', 'description'} <= treatment.keys():
+            raise ValueError(f'Invalid treatment {treatment}, expected an id, name and description')
+        int(treatment['id'])
+    return document['treatments']
+
+
+def snapshot_path_of(path: str, snapshot_file: str = None) -> str:
+    """
+    The path of the snapshot of the treatments file.
+    :param path: the path of the treatments file.
+    :param snapshot_file: the snapshot file, relative to the directory of the treatments file, defaults to <file>.json
+    :return: the path of the snapshot.
+    """
+    return os.path.join(os.path.dirname(path), snapshot_file or f'{os.path.basename(path)}.json')
+
+
+def load_treatments(path: str, snapshot_path: typing.Optional[str]) -> typing.Tuple[typing.List[dict], str]:
+    """
+    Loads the treatments from the snapshot if it matches the treatments file, else parses the treatments file
+    and rebuilds the snapshot. Failing to write the snapshot, e.g. on a read only file system, is not an error.
+    :param path: the path of the treatments file.
+    :param snapshot_path: the path of the snapshot, or None to parse the treatments file.
+    :return: the treatments and the source, either snapshot or yaml.
+    :raises: OSError, yaml.YAMLError or ValueError if the treatments file cannot be read or parsed.
+    """
+    with open(path, 'rb') as file:
+        content = file.read()
+    if snapshot_path is None:
+        return parse_treatments(yaml.load(content, Loader=YAML_LOADER)), 'yaml'
+
+    digest = hashlib.sha256(content).hexdigest()
+    treatments = _read_snapshot(snapshot_path, digest)
+    if treatments is not None:
+        return treatments, 'snapshot'
+    treatments = parse_treatments(yaml.load(content, Loader=YAML_LOADER))
+    try:
+        _write_snapshot(snapshot_path, digest, treatments)
+    except OSError:
+        pass
+    return treatments, 'yaml'
+
+
+def compile_treatments(path: str, snapshot_path: str) -> int:
+    """
+    Parses the treatments file and writes the snapshot.
+    :param path: the path of the treatments file.
+    :param snapshot_path: the path of the snapshot.
+    :return: the number of treatments.
+    """
+    with open(path, 'rb') as file:
+        content = file.read()
+    treatments = parse_treatments(yaml.load(content, Loader=YAML_LOADER))
+    _write_snapshot(snapshot_path, hashlib.sha256(content).hexdigest(), treatments)
+    return len(treatments)
+
+
+def _read_snapshot(snapshot_path: str, digest: str) -> typing.Optional[typing.List[dict]]:
+    """
+    Reads the snapshot.
+    :return: the treatments, or None if there is no valid snapshot for the digest.
+    """
+    try:
+        with open(snapshot_path, 'rt', encoding='utf8') as file:
+            snapshot = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION \
+            or snapshot.get('sha256') != digest or not isinstance(snapshot.get('treatments'), list):
+        return None
+    return snapshot['treatments']
+
+
+def _write_snapshot(snapshot_path: str, digest: str, treatments: typing.List[dict]):
+    """
+    Writes the snapshot to a temporary file and moves it in place, so that a concurrent reader never sees
+    a partial snapshot.
+    """
+    directory = os.path.dirname(snapshot_path) or '.'
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix='.treatments-', suffix='.json')
+    try:
+        with os.fdopen(descriptor, 'wt', encoding='utf8') as file:
+            json.dump({'version': SNAPSHOT_VERSION, 'sha256': digest, 'treatments': treatments}, file,
+                      ensure_ascii=False)
+        os.replace(temporary_path, snapshot_path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
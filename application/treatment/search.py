@@ -0,0 +1,70 @@
+"""
+The text search of the treatment catalog: an inverted index of the words in the names and descriptions of
+the treatments, built once per catalog snapshot.
+"""
+import bisect
+import re
+import typing
+import unicodedata
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text: typing.Optional[str]) -> typing.List[str]:
+    """
+    Splits the text in lower case words without accents, so that 'één' matches 'een'.
+    :param text: the text.
+    :return: the words.
+    """
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _WORD.findall(text)
+
+
+class TreatmentIndex:  # pylint: disable=R0903
+    """
+    Inverted index from word to the positions of the treatments in the catalog. A query matches the treatments
+    that contain every query word as a prefix of one of their words.
+    """
+    __slots__ = ('words', 'postings')
+
+    def __init__(self, documents: typing.Iterable[str]):
+        """
+        Builds the index.
+        :param documents: the searchable text of the treatments, in catalog order.
+        """
+        postings: typing.Dict[str, typing.Set[int]] = {}
+        for position, document in enumerate(documents):
+            for word in tokenize(document):
+                postings.setdefault(word, set()).add(position)
+        self.words: typing.List[str] = sorted(postings)
+        self.postings: typing.Dict[str, typing.FrozenSet[int]] = {word: frozenset(positions)
+                                                                   for word, positions in postings.items()}
+
+    def search(self, query: str) -> typing.List[int]:
+        """
+        Searches the treatments.
+        :param query: the query.
+        :return: the positions of the matching treatments, in catalog order.
+        """
+        matches: typing.Optional[typing.Set[int]] = None
+        # the most selective words first, so that the intersection shrinks fast
+        for word in sorted(set(tokenize(query)), key=len, reverse=True):
+            positions = self._prefix(word)
+            matches = positions if matches is None else matches & positions
+            if not matches:
+                return []
+        return sorted(matches) if matches is not None else []
+
+    def _prefix(self, prefix: str) -> typing.Set[int]:
+        """
+        The positions of the treatments with a word that starts with the prefix.
+        """
+        positions: typing.Set[int] = set()
+        index = bisect.bisect_left(self.words, prefix)
+        while index < len(self.words) and self.words[index].startswith(prefix):
+            positions |= self.postings[self.words[index]]
+            index += 1
+        return positions
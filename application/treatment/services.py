@@ -1,31 +1,164 @@
 """
 The services module of this blueprint.
 """
+import bisect
 import os
+import threading
+import time
 import typing
+from types import MappingProxyType
 
-import yaml
-from flask import current_app
-from yaml import BaseLoader
+from flask import Flask, current_app, json
+from sqlalchemy import bindparam
 
+from application.caching import etag_of
 from application.database import db
+from application.treatment.compiled import load_treatments, snapshot_path_of
 from application.treatment.models import Treatment
+from application.treatment.search import TreatmentIndex
 
 
 def _require_init(function: typing.Callable):
     """
-    Decorator for calling the init function.
+    Decorator for calling the init function once, for the lazy initialization when the app has not
+    initialized the service at startup.
     :return: the wrapper.
     """
 
     def wrapper(self, *args, **kwargs):
         if not self.initialized:
-            self.init()
+            self.ensure_initialized()
         return function(self, *args, **kwargs)
 
     return wrapper
 
 
+def _file_version(path: str) -> typing.Optional[typing.Tuple[int, int]]:
+    """
+    The modification time and size of a file.
+    :return: the version, or None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class TreatmentSnapshot:  # pylint: disable=R0902
+    """
+    An immutable snapshot of the treatment catalog: the views of the treatments indexed by id, the JSON
+    responses of the treatments and of all treatments rendered in advance with their ETags, and the search index.
+    """
+    __slots__ = ('ids', 'treatments', 'responses', 'etags', 'all_response', 'all_etag', 'index', 'created_at')
+
+    FIELDS = ('id', 'name', 'description')
+
+    def __init__(self, treatments: typing.Iterable[Treatment]):
+        """
+        Renders the snapshot, within an app context for the JSON settings of the app.
+        :param treatments: the treatments, ordered by id.
+        """
+        views = [treatment.to_view() for treatment in treatments]
+        self.ids: typing.Tuple[int, ...] = tuple(view['id'] for view in views)
+        self.treatments: typing.Mapping[int, typing.Mapping[str, typing.Any]] = MappingProxyType(
+            {view['id']: MappingProxyType(view) for view in views})
+        self.responses: typing.Mapping[int, bytes] = MappingProxyType(
+            {view['id']: _render(view) for view in views})
+        self.etags: typing.Mapping[int, str] = MappingProxyType(
+            {treatment_id: etag_of(response) for treatment_id, response in self.responses.items()})
+        self.all_response: bytes = _render({'treatments': views})
+        self.all_etag = etag_of(self.all_response)
+        self.index = TreatmentIndex(f'{view["name"] or ""} {view["description"] or ""}' for view in views)
+        self.created_at = time.time()
+
+    def render_many(self, ids: typing.Iterable[int]) -> bytes:
+        """
+        Renders the treatments of the ids from the pre-rendered responses, in the order of the ids.
+        :param ids: the treatment ids.
+        :return: the JSON response with the found treatments and the missing ids.
+        """
+        found, missing = [], []
+        for treatment_id in dict.fromkeys(ids):
+            response = self.responses.get(treatment_id)
+            if response is None:
+                missing.append(treatment_id)
+            else:
+                found.append(response[:-1])
+        return b'{"missing":%s,"treatments":[%s]}\n' % (json.dumps(missing, separators=(',', ':')).encode('utf8'),
+                                                        b','.join(found))
+
+    def page(self, query: str = None, fields: typing.Sequence[str] = FIELDS, offset: int = 0,  # pylint: disable=R0913
+             cursor: int = None, limit: int = 100) -> dict:
+        """
+        Lists a page of the treatments, ordered by id.
+        :param query: the search query, matches the treatments with all words in the name or description.
+        :param fields: the fields of the treatments to include.
+        :param offset: the number of treatments to skip.
+        :param cursor: continue after the treatment with this id, the next_cursor of the previous page.
+        :param limit: the maximum number of treatments.
+        :return: the treatments, the total number of matching treatments and the cursor of the next page.
+        """
+        positions: typing.Sequence[int] = self.index.search(query) if query else range(len(self.ids))
+        start = 0
+        if cursor is not None:
+            start = bisect.bisect_left(positions, bisect.bisect_right(self.ids, cursor))
+        selected = positions[start + offset:start + offset + limit]
+        treatments = [self.treatments[self.ids[position]] for position in selected]
+        more = start + offset + limit < len(positions)
+        return {'treatments': [{field: treatment[field] for field in fields} for treatment in treatments],
+                'total': len(positions),
+                'next_cursor': str(treatments[-1]['id']) if more and treatments else None}
+
+
+def _render(view: dict) -> bytes:
+    """
+    Renders the view like jsonify does, without the pretty printing of debug mode.
+    """
+    return (json.dumps(view, separators=(',', ':')) + '\n').encode('utf8')
+
+
+class TreatmentCatalog:
+    """
+    Read through catalog of the treatments in the database. The reads use the current snapshot without locking,
+    a refresh renders a new snapshot and replaces the reference to the current one in a single assignment.
+    """
+
+    def __init__(self):
+        self.refreshes = 0
+        self._snapshot: typing.Optional[TreatmentSnapshot] = None
+
+    @property
+    def snapshot(self) -> TreatmentSnapshot:
+        """
+        The current snapshot, loaded from the database on first use.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.refresh()
+        return snapshot
+
+    def refresh(self) -> TreatmentSnapshot:
+        """
+        Loads the treatments from the database into a new snapshot and swaps it in.
+        :return: the new snapshot.
+        """
+        snapshot = TreatmentSnapshot(Treatment.query.order_by(Treatment.id).all())
+        self._snapshot = snapshot
+        self.refreshes += 1
+        return snapshot
+
+    def stats(self) -> dict:
+        """
+        The size and age of the catalog.
+        :return: the counters as dict.
+        """
+        snapshot = self._snapshot
+        return {'size': len(snapshot.treatments) if snapshot else 0,
+                'refreshes': self.refreshes,
+                'age': time.time() - snapshot.created_at if snapshot else None}
+
+
 class TreatmentService:
     """
     The service responsible for managing the treatments in this module.
@@ -33,51 +166,198 @@ class TreatmentService:
 
     def __init__(self, yaml_file='treatments.yaml'):
         self.initialized = False
+        self.init_seconds = None
         self.yaml_file = yaml_file
+        self.file_version = None
+        self.source = None
+        self.catalog = TreatmentCatalog()
+        self._init_lock = threading.Lock()
+
+    def ensure_initialized(self) -> bool:
+        """
+        Initializes the service exactly once, concurrent callers wait for the initialization in progress.
+        :return: True if this call initialized the service.
+        """
+        with self._init_lock:
+            if self.initialized:
+                return False
+            start = time.perf_counter()
+            self.init()
+            self.init_seconds = time.perf_counter() - start
+        current_app.logger.info('Initialized the treatments in %.1f ms', self.init_seconds * 1e3)
+        return True
 
     def init(self):
         """
         Initializes the treatments from the provided YAML file and synchronizes them with the database.
         """
+        self._load()
+        self.initialized = True
+
+    def reload(self):
+        """
+        Reloads the treatments from the YAML file, synchronizes them with the database and swaps in the
+        new catalog. The current catalog stays in place if the file cannot be parsed.
+        :raises: OSError, YAMLError or ValueError if the file cannot be read or parsed.
+        """
+        with self._init_lock:
+            self._load()
+
+    def is_modified(self) -> bool:
+        """
+        Checks if the YAML file has changed since it was loaded, by modification time and size.
+        :return: True if the file has changed.
+        """
+        return _file_version(self.path()) != self.file_version
+
+    def path(self) -> str:
+        """
+        The path of the YAML file, TREATMENT_FILE if configured, relative to the resources directory.
+        :return: the path.
+        """
         resource_path = os.path.join(os.path.split(__file__)[0], "resources")
-        with open(f'{resource_path}/{self.yaml_file}', 'rt') as file, current_app.app_context():
-            treatments = yaml.load(file, Loader=BaseLoader)
-            with current_app.app_context():
-                for treatment in treatments['treatments']:
-                    treatment_id = int(treatment['id'])
-                    existing_treatment = Treatment.query.get(treatment_id)
-                    if existing_treatment is None:
-                        new_treatment = Treatment(id=treatment_id, name=treatment['name'],
-                                                  description=treatment['description'])
-                        db.session.add(new_treatment)
-                    else:
-                        existing_treatment.name = treatment['name']
-                        existing_treatment.description = treatment['description']
+        return os.path.join(resource_path, current_app.config.get('TREATMENT_FILE') or self.yaml_file)
+
+    def _load(self):
+        path = self.path()
+        version = _file_version(path)
+        snapshot_path = None
+        if current_app.config.get('TREATMENT_SNAPSHOT_ENABLED', False):
+            snapshot_path = snapshot_path_of(path, current_app.config.get('TREATMENT_SNAPSHOT_FILE'))
+        treatments, self.source = load_treatments(path, snapshot_path)
+        self.sync(treatments, delete=current_app.config.get('TREATMENT_SYNC_DELETE', False),
+                  batch_size=current_app.config.get('TREATMENT_SYNC_BATCH_SIZE', 500))
+        self.catalog.refresh()
+        self.file_version = version
+
+    @staticmethod
+    def sync(treatments: typing.Iterable[dict], delete: bool = False, batch_size: int = 500) -> dict:  # pylint: disable=R0914
+        """
+        Synchronizes the treatments with the database. The existing treatments are loaded in a single query,
+        the inserts, updates and deletions are executed in batches, and nothing is written when nothing changed.
+        :param treatments: the treatments, with id, name and description.
+        :param delete: delete the treatments in the database that are not in the treatments.
+        :param batch_size: the maximum number of rows per statement.
+        :return: the number of inserted, updated, deleted and unchanged treatments.
+        """
+        start = time.perf_counter()
+        existing = {row.id: (row.name, row.description)
+                    for row in db.session.query(Treatment.id, Treatment.name, Treatment.description)}
+        loaded = time.perf_counter()
+
+        wanted = {int(treatment['id']): (treatment['name'], treatment['description']) for treatment in treatments}
+        inserts = [{'id': treatment_id, 'name': name, 'description': description}
+                   for treatment_id, (name, description) in wanted.items() if treatment_id not in existing]
+        updates = [{'_id': treatment_id, 'name': name, 'description': description}
+                   for treatment_id, (name, description) in wanted.items()
+                   if treatment_id in existing and existing[treatment_id] != (name, description)]
+        deletions = [treatment_id for treatment_id in existing if treatment_id not in wanted] if delete else []
+        compared = time.perf_counter()
+
+        table = Treatment.__table__
+        if inserts or updates or deletions:
+            update = table.update().where(table.c.id == bindparam('_id')).values(name=bindparam('name'),
+                                                                               description=bindparam('description'))
+            try:
+                for index in range(0, len(inserts), batch_size):
+                    db.session.execute(table.insert(), inserts[index:index + batch_size])
+                for index in range(0, len(updates), batch_size):
+                    db.session.execute(update, updates[index:index + batch_size])
+                for index in range(0, len(deletions), batch_size):
+                    db.session.execute(table.delete().where(table.c.id.in_(deletions[index:index + batch_size])))
                 db.session.commit()
-        self.initialized = True
+            except Exception:
+                db.session.rollback()
+                raise
+        written = time.perf_counter()
+
+        result = {'inserted': len(inserts), 'updated': len(updates), 'deleted': len(deletions),
+                  'unchanged': len(wanted) - len(inserts) - len(updates)}
+        current_app.logger.info('Synchronized the treatments %s: load %.1f ms, diff %.1f ms, write %.1f ms', result,
+                                (loaded - start) * 1e3, (compared - loaded) * 1e3, (written - compared) * 1e3)
+        return result
 
-    # pylint: disable=R0201
     @_require_init
-    def get_all_treatments(self) -> typing.List[Treatment]:
+    def get_catalog(self) -> TreatmentSnapshot:
         """
-        Gets all the treatments in the database.
-        :return:
+        Gets the current snapshot of the treatment catalog, for the read API.
+        :return: the snapshot.
         """
-        # if not self.initialized:
-        #     self.init()
-        with current_app.app_context():
-            return Treatment.query.all()
+        return self.catalog.snapshot
 
-    # pylint: disable=R0201
-    @_require_init
-    def get_treatment(self, treatment_id: int) -> Treatment:
+
+class TreatmentWatcher:  # pylint: disable=R0902
+    """
+    Background job that checks the YAML file of the treatments every TREATMENT_RELOAD_INTERVAL seconds, and
+    reloads the treatments when the file has changed. A file that fails to load is not retried until it
+    changes again.
+    """
+
+    def __init__(self, app: Flask, treatment_service: TreatmentService):
+        self.app = app
+        self.treatment_service = treatment_service
+        self.checks = 0
+        self.reloads = 0
+        self.failures = 0
+        self.last_duration = None
+        self.last_error = None
+        self._failed_version = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the background thread.
+        """
+        self._thread = threading.Thread(target=self._run, name='treatment-watcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config.get('TREATMENT_RELOAD_INTERVAL', 10))
+            with self.app.app_context():
+                self.check()
+
+    def check(self) -> bool:
         """
-        Gets a treatment by id.
-        :param treatment_id: the treatment id
-        :return: a treatment found with the id, or none.
+        Reloads the treatments if the YAML file has changed.
+        :return: True if the treatments were reloaded.
         """
-        # if not self.initialized:
-        #     self.init()
+        with self._lock:
+            self.checks += 1
+        if not self.treatment_service.initialized or not self.treatment_service.is_modified():
+            return False
+        version = _file_version(self.treatment_service.path())
+        if version == self._failed_version:
+            return False
+        start = time.perf_counter()
+        try:
+            self.treatment_service.reload()
+        # pylint: disable=W0703
+        except Exception as error:
+            self.app.logger.exception('Reloading the treatments failed, the current catalog is kept')
+            with self._lock:
+                self._failed_version = version
+                self.failures += 1
+                self.last_error = str(error)
+                self.last_duration = time.perf_counter() - start
+            return False
+        with self._lock:
+            self._failed_version = None
+            self.reloads += 1
+            self.last_error = None
+            self.last_duration = time.perf_counter() - start
+        self.app.logger.info('Reloaded the treatments in %.1f ms', self.last_duration * 1e3)
+        return True
 
-        with current_app.app_context():
-            return Treatment.query.get(treatment_id)
+    def stats(self) -> dict:
+        """
+        The counters of this job.
+        :return: the counters as dict.
+        """
+        with self._lock:
+            return {'checks': self.checks,
+                    'reloads': self.reloads,
+                    'failures': self.failures,
+                    'last_duration': self.last_duration,
+                    'last_error': self.last_error}
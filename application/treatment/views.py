@@ -1,12 +1,49 @@
 """
 The view objects for this module.
 """
-from flask import Blueprint, session, abort
+import typing
+
+from flask import Blueprint, Response, abort, current_app, jsonify, request
 from flask_classful import FlaskView
 
+from application.caching import conditional_response
+from application.hti.context import current_launch
 from application.security import require_session_json
 from application.treatment.services import TreatmentService
 
+# The query parameters of a page of the treatments, other parameters, like a cache buster, return all treatments.
+PAGE_PARAMETERS = ('q', 'fields', 'offset', 'cursor', 'limit')
+
+
+def _json_response(body: typing.Optional[bytes], etag: str = None) -> Response:
+    """
+    Wraps a pre-rendered JSON body in a conditional response, with the Cache-Control of TREATMENT_CACHE_CONTROL.
+    :param body: the JSON body.
+    :param etag: the ETag of the body, computed from the body if not set.
+    :return: the response, a 304 if the ETag matches If-None-Match, or a 404 if there is no body.
+    """
+    if body is None:
+        return abort(404)
+    response = current_app.response_class(body, mimetype=current_app.config['JSONIFY_MIMETYPE'])
+    return conditional_response(response, current_app.config.get('TREATMENT_CACHE_CONTROL', 'private, no-cache'),
+                                etag)
+
+
+def _non_negative_int(value: typing.Optional[str], default: typing.Optional[int]) -> typing.Optional[int]:
+    """
+    Parses a non negative integer query parameter.
+    :param value: the query parameter, if any.
+    :param default: the default if the query parameter is not set.
+    :return: the integer.
+    :raises: ValueError if the value is not a non negative integer.
+    """
+    if value is None or value == '':
+        return default
+    number = int(value)
+    if number < 0:
+        raise ValueError(value)
+    return number
+
 
 def create_blueprint():
     """
@@ -23,6 +60,21 @@ def create_blueprint():
         The implementation of the /api/treatment API segment.
         """
 
+        @require_session_json
+        def index(self):
+            """
+            Gets the treatments of the comma separated ids query parameter, at most TREATMENT_BATCH_MAX_SIZE.
+            :return: the found treatments in the order of the ids, and the ids that were not found.
+            """
+            max_size = current_app.config.get('TREATMENT_BATCH_MAX_SIZE', 100)
+            try:
+                ids = [int(treatment_id) for treatment_id in request.args.get('ids', '').split(',') if treatment_id]
+            except ValueError:
+                return abort(400, 'Bad Request, the ids must be comma separated integers')
+            if not ids or len(ids) > max_size:
+                return abort(400, f'Bad Request, the ids parameter must have 1 to {max_size} ids')
+            return _json_response(treatment_service.get_catalog().render_many(ids))
+
         @require_session_json
         def get(self, treatment_id: int):
             """
@@ -30,16 +82,36 @@ def create_blueprint():
             :param treatment_id:
             :return: a treatment, else 404
             """
-            treatment = treatment_service.get_treatment(treatment_id)
-            return treatment.to_view() if treatment is not None else abort(404)
+            snapshot = treatment_service.get_catalog()
+            return _json_response(snapshot.responses.get(treatment_id), snapshot.etags.get(treatment_id))
 
         @require_session_json
         def all(self):
             """
-            Gets all treatments.
-            :return: all treatments.
+            Gets all treatments. With any of the PAGE_PARAMETERS, a page of the treatments is returned:
+            q: the search query, fields: the comma separated fields to include, offset and cursor: the start
+            of the page, the cursor is the next_cursor of the previous page, limit: the size of the page, at
+            most TREATMENT_PAGE_MAX_LIMIT.
+            :return: all treatments, or the page of treatments with the total and the next_cursor.
             """
-            return {'treatments': [treatment.to_view() for treatment in treatment_service.get_all_treatments()]}
+            snapshot = treatment_service.get_catalog()
+            if not any(parameter in request.args for parameter in PAGE_PARAMETERS):
+                return _json_response(snapshot.all_response, snapshot.all_etag)
+
+            max_limit = current_app.config.get('TREATMENT_PAGE_MAX_LIMIT', 100)
+            fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+            if any(field not in snapshot.FIELDS for field in fields):
+                return abort(400, f'Bad Request, the fields must be any of {", ".join(snapshot.FIELDS)}')
+            try:
+                offset = _non_negative_int(request.args.get('offset'), 0)
+                cursor = _non_negative_int(request.args.get('cursor'), None)
+                limit = _non_negative_int(request.args.get('limit'), max_limit)
+            except ValueError:
+                return abort(400, 'Bad Request, offset, cursor and limit must be non negative integers')
+            page = snapshot.page(query=request.args.get('q'), fields=fields or snapshot.FIELDS, offset=offset,
+                                 cursor=cursor, limit=min(limit, max_limit))
+            return conditional_response(jsonify(page),
+                                        current_app.config.get('TREATMENT_CACHE_CONTROL', 'private, no-cache'))
 
         @require_session_json
         def current(self):
@@ -47,14 +119,12 @@ def create_blueprint():
             Gets the current treatment from the FHIR task from the HTI launch object.
             :return: the current treatment from the FHIR task from the HTI launch object.
             """
-            task = session.get('task')
-            definition_reference: str = task['definitionReference']['reference']
-            task_id = definition_reference.split('ActivityDefinition/')[1]
-            if task_id is not None:
-                treatment = treatment_service.get_treatment(int(task_id))
-                return treatment.to_view() if treatment is not None else abort(404)
-            return abort(404)
+            snapshot = treatment_service.get_catalog()
+            treatment_id = current_launch().treatment_id
+            return _json_response(snapshot.responses.get(treatment_id), snapshot.etags.get(treatment_id))
 
     TreatmentView.register(blueprint, route_base='/api/treatment', trailing_slash=False)
 
+    blueprint.treatment_service = treatment_service
+
     return blueprint
@@ -1,8 +1,10 @@
 """
 The views module of this blueprint module.
 """
-from flask import Blueprint, session
+from flask import Blueprint, current_app, jsonify
 
+from application.caching import conditional_response
+from application.hti.context import current_launch
 from application.security import require_session_json
 from application.user.services import UserService
 
@@ -24,8 +26,7 @@ def create_blueprint() -> Blueprint:
         Shows the current user, stored in the session
         :return:
         """
-        task = session.get('task')
-        for_user = task['for']['reference']
-        return user_service.get_user(for_user)
+        return conditional_response(jsonify(user_service.get_user(current_launch().user_reference)),
+                                    current_app.config.get('USER_CACHE_CONTROL', 'private, no-cache'))
 
     return blueprint
@@ -0,0 +1,3 @@
+"""
+Benchmarks of this application, run them with python -m benchmarks.<module>.
+"""
@@ -0,0 +1,55 @@
+"""
+Runs the service layer microbenchmarks and compares them with the stored baseline.
+
+python -m benchmarks                  # run and compare with benchmarks/baseline.json
+python -m benchmarks --save           # run and store the results as the new baseline
+python -m benchmarks --threshold=0.1  # fail on a regression of more than 10%
+"""
+import sys
+
+import fire
+
+from benchmarks import runner, services
+from benchmarks.stub import StubPortal
+
+
+def main(iterations: int = 2000, warmup: int = 200, save: bool = False, threshold: float = 0.25,
+         baseline: str = runner.BASELINE_FILE, only: str = None):
+    """
+    Runs the benchmarks, prints the results and compares them with the baseline.
+    :param iterations: the number of timed calls per benchmark.
+    :param warmup: the number of calls per benchmark before timing starts.
+    :param save: store the results as the new baseline.
+    :param threshold: the allowed relative regression.
+    :param baseline: the baseline file.
+    :param only: run only the benchmarks whose name contains this text.
+    """
+    portal = StubPortal().start()
+    try:
+        app = services.create_benchmark_app(portal)
+        results = {}
+        with app.app_context():
+            print(f'{"benchmark":<40} {"ops/s":>12} {"p50 us":>10} {"p99 us":>10}')
+            for name, function in services.cases(portal, iterations + warmup).items():
+                if only and only not in name:
+                    continue
+                result = runner.measure(function, iterations, warmup)
+                results[name] = result
+                print(f'{name:<40} {result["ops_per_sec"]:>12,.1f} {result["p50_us"]:>10,.1f} {result["p99_us"]:>10,.1f}')
+    finally:
+        portal.stop()
+
+    if save:
+        runner.save_baseline(dict(runner.load_baseline(baseline), **results), baseline)
+        print(f'Stored the baseline in {baseline}')
+        return
+
+    regressions = runner.compare(results, runner.load_baseline(baseline), threshold)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -0,0 +1,207 @@
+"""
+End-to-end load test of the launch flow against the waitress server of entrypoint.py. Every virtual user
+repeats the flow of a patient: the launch by the portal, the index page and the API calls of the single
+page interface. The users are started evenly over the ramp period.
+
+python -m benchmarks.load --users=20 --ramp=10 --duration=60
+"""
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+from urllib.parse import urlencode
+
+import fire
+
+from benchmarks.runner import percentile
+from benchmarks.stub import StubPortal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = ('POST /module_launch', 'GET /index.html', 'GET /api/user/current', 'GET /api/treatment/current',
+             'GET /api/treatment/all')
+
+
+class Recorder:
+    """
+    Collects the latencies and errors per endpoint of all virtual users.
+    """
+
+    def __init__(self):
+        self.latencies: typing.Dict[str, typing.List[float]] = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors: typing.Dict[str, int] = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.recording = False
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, seconds: float, ok: bool):
+        """
+        Records a request, requests during the ramp are not recorded.
+        :param endpoint: the endpoint.
+        :param seconds: the latency.
+        :param ok: whether the response had the expected status.
+        """
+        if not self.recording:
+            return
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+
+class VirtualUser(threading.Thread):
+    """
+    A patient that is launched from the portal over and over again, with a keep-alive connection
+    and its own session cookie.
+    """
+
+    def __init__(self, portal: StubPortal, host: str, port: int, recorder: Recorder, stop: threading.Event):
+        threading.Thread.__init__(self, daemon=True)
+        self.portal = portal
+        self.host = host
+        self.port = port
+        self.recorder = recorder
+        self.stop = stop
+        self.cookie = None
+        self.connection = None
+
+    def run(self):
+        while not self.stop.is_set():
+            self.cookie = None
+            token = self.portal.token(f'{self.host}:{self.port}')
+            if self.request('POST /module_launch', 302, urlencode({'token': token}).encode('ascii')):
+                for endpoint in ENDPOINTS[1:]:
+                    self.request(endpoint, 200)
+        if self.connection is not None:
+            self.connection.close()
+
+    def request(self, endpoint: str, expected_status: int, body: bytes = None) -> bool:
+        """
+        Performs the request with the session cookie and records the latency.
+        :return: True if the response had the expected status.
+        """
+        method, path = endpoint.split(' ', 1)
+        headers = {'Host': f'{self.host}:{self.port}'}
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            status = response.status
+            for header, value in response.getheaders():
+                if header.lower() == 'set-cookie' and value.startswith('session='):
+                    self.cookie = value.split(';', 1)[0]
+            if response.will_close:
+                self.connection.close()
+                self.connection = None
+        except (OSError, http.client.HTTPException):
+            status = None
+            self.connection.close()
+            self.connection = None
+        self.recorder.record(endpoint, time.perf_counter() - start, status == expected_status)
+        return status == expected_status
+
+
+def start_server(portal: StubPortal, port: int, threads: int, database: str) -> subprocess.Popen:
+    """
+    Starts entrypoint.py in a subprocess, with the stub portal as the only allowed portal, and waits until it is ready.
+    :param database: the SQLAlchemy URI of the database of the server.
+    :return: the server process.
+    """
+    env = dict(os.environ, PORT=str(port), WAITRESS_THREADS=str(threads), HTI_ALLOWED_PORTALS=portal.issuer,
+               HTI_JWKS_REFRESH_ENABLED='true', SQLALCHEMY_DATABASE_URI=database)
+    server = subprocess.Popen([sys.executable, 'entrypoint.py'], cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'The server exited with {server.returncode}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/health/ready')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return server
+            connection.close()
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('The server did not become ready within 30 seconds')
+
+
+def report(recorder: Recorder, duration: float):
+    """
+    Prints the throughput, latency percentiles and error rate per endpoint.
+    """
+    print(f'{"endpoint":<28} {"requests":>9} {"req/s":>9} {"errors":>8} {"p50 ms":>9} {"p90 ms":>9} '
+          f'{"p99 ms":>9} {"max ms":>9}')
+    for endpoint in ENDPOINTS:
+        latencies = sorted(recorder.latencies[endpoint])
+        count = len(latencies)
+        errors = recorder.errors[endpoint]
+        if not count:
+            print(f'{endpoint:<28} {0:>9}')
+            continue
+        print(f'{endpoint:<28} {count:>9} {count / duration:>9.1f} {errors / count:>8.2%} '
+              f'{percentile(latencies, 0.5) * 1e3:>9.1f} {percentile(latencies, 0.9) * 1e3:>9.1f} '
+              f'{percentile(latencies, 0.99) * 1e3:>9.1f} {latencies[-1] * 1e3:>9.1f}')
+
+
+def main(users: int = 10, ramp: float = 5.0, duration: float = 30.0, port: int = 8089, threads: int = 4,
+         database: str = None):
+    """
+    Runs the load test.
+    :param users: the number of concurrent virtual users.
+    :param ramp: the seconds over which the users are started, these requests are not reported.
+    :param duration: the seconds of load after the ramp.
+    :param port: the port of the server.
+    :param threads: the number of waitress threads of the server.
+    :param database: the SQLAlchemy URI of the database of the server, defaults to SQLALCHEMY_DATABASE_URI, or to a
+    SQLite file in a temporary directory. An in-memory SQLite database is not shared by the waitress threads.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        database = database or os.environ.get('SQLALCHEMY_DATABASE_URI') or \
+                   f'sqlite:///{os.path.join(directory, "load.db")}'
+        run(users, ramp, duration, port, threads, database)
+
+
+def run(users: int, ramp: float, duration: float, port: int, threads: int, database: str):
+    """
+    Runs the load test against a server with the given database, see main.
+    """
+    portal = StubPortal().start()
+    server = start_server(portal, port, threads, database)
+    recorder = Recorder()
+    stop = threading.Event()
+    try:
+        virtual_users = [VirtualUser(portal, '127.0.0.1', port, recorder, stop) for _ in range(users)]
+        for virtual_user in virtual_users:
+            virtual_user.start()
+            time.sleep(ramp / users)
+        recorder.recording = True
+        start = time.monotonic()
+        time.sleep(duration)
+        recorder.recording = False
+        elapsed = time.monotonic() - start
+        stop.set()
+        for virtual_user in virtual_users:
+            virtual_user.join(timeout=30)
+    finally:
+        server.terminate()
+        server.wait()
+        portal.stop()
+    print(f'{users} users, {threads} server threads, {elapsed:.1f} seconds')
+    report(recorder, elapsed)
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -0,0 +1,84 @@
+"""
+Measurement and baseline comparison of the benchmarks.
+"""
+import json
+import os
+import time
+import typing
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def percentile(timings: typing.Sequence[float], fraction: float) -> float:
+    """
+    The nearest rank percentile of sorted timings.
+    :param timings: the sorted timings.
+    :param fraction: the percentile as fraction, e.g. 0.99.
+    :return: the timing at the percentile.
+    """
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def measure(function: typing.Callable[[], typing.Any], iterations: int, warmup: int) -> dict:
+    """
+    Calls the function repeatedly and times every call.
+    :param function: the function to benchmark.
+    :param iterations: the number of timed calls.
+    :param warmup: the number of calls before timing starts.
+    :return: the operations per second and the p50 and p99 latency in microseconds.
+    """
+    for _ in range(warmup):
+        function()
+    timings = []
+    clock = time.perf_counter_ns
+    for _ in range(iterations):
+        start = clock()
+        function()
+        timings.append(clock() - start)
+    timings.sort()
+    return {'ops_per_sec': round(1e9 * iterations / sum(timings), 1),
+            'p50_us': round(percentile(timings, 0.5) / 1000, 1),
+            'p99_us': round(percentile(timings, 0.99) / 1000, 1)}
+
+
+def load_baseline(path: str = BASELINE_FILE) -> typing.Dict[str, dict]:
+    """
+    Loads the stored baseline, if any.
+    :param path: the baseline file.
+    :return: the results by benchmark name.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rt') as file:
+        return json.load(file)
+
+
+def save_baseline(results: typing.Dict[str, dict], path: str = BASELINE_FILE):
+    """
+    Stores the results as the new baseline.
+    :param results: the results by benchmark name.
+    :param path: the baseline file.
+    """
+    with open(path, 'wt') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare(results: typing.Dict[str, dict], baseline: typing.Dict[str, dict], threshold: float) -> typing.List[str]:
+    """
+    Compares the results with the baseline.
+    :param results: the results by benchmark name.
+    :param baseline: the baseline by benchmark name.
+    :param threshold: the allowed relative regression, 0.25 allows 25% fewer operations per second or 25% higher p99.
+    :return: a description of every regression.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+            regressions.append(f'{name}: {result["ops_per_sec"]} ops/s, baseline {base["ops_per_sec"]} ops/s')
+        if result['p99_us'] > base['p99_us'] * (1 + threshold):
+            regressions.append(f'{name}: p99 {result["p99_us"]} us, baseline {base["p99_us"]} us')
+    return regressions
@@ -0,0 +1,57 @@
+"""
+Microbenchmarks of the service layer: the HTI launch, the jwks discovery, the JTI store and the treatments.
+
+python -m benchmarks --iterations=2000
+"""
+import itertools
+import typing
+
+from flask import Flask
+
+from application import create_app
+from application.hti.services import hti_launch_service, jwks_discovery_service, jwt_model_service
+from application.hti.token import ParsedToken
+from application.treatment.services import TreatmentService
+from benchmarks.stub import StubPortal
+
+AUDIENCE = 'localhost'
+
+
+def create_benchmark_app(portal: StubPortal) -> Flask:
+    """
+    Creates an app instance with an in memory database that allows the stub portal.
+    :param portal: the stub portal.
+    :return: the app instance.
+    """
+    return create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+                       'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+                       'SECRET_KEY': 'benchmark',
+                       'HTI_ALLOWED_PORTALS': portal.issuer})
+
+
+def cases(portal: StubPortal, count: int) -> typing.Dict[str, typing.Callable[[], typing.Any]]:
+    """
+    Prepares the benchmark cases, the tokens are signed up front so that signing is not measured.
+    :param portal: the stub portal.
+    :param count: the number of calls per case, including the warmup.
+    :return: the cases by name, every case must be called within an app context.
+    """
+    tokens = [portal.token(AUDIENCE) for _ in range(count)]
+    launch_tokens = iter(tokens)
+    jtis = (f'benchmark-{index}' for index in itertools.count())
+    token = ParsedToken(tokens[0])
+    url = f'{portal.issuer}/.well-known/jwks.json'
+    treatment_service = TreatmentService()
+    treatment_service.init()
+
+    return {
+        'ParsedToken': lambda: ParsedToken(tokens[0]),
+        'HtiLaunchService.launch': lambda: hti_launch_service.launch(next(launch_tokens), AUDIENCE),
+        'JwksDiscoveryService.get_jwks_by_kid': lambda: jwks_discovery_service.get_jwks_by_kid(url, token.kid,
+                                                                                               token.alg),
+        'JwksDiscoveryService.fetch_jwks': lambda: jwks_discovery_service.fetch_jwks(url),
+        'JwtModelService.register_jti': lambda: jwt_model_service.register_jti(next(jtis), 4102444800),
+        'TreatmentCatalog.snapshot': lambda: treatment_service.get_catalog().responses.get(2),
+        'TreatmentCatalog.render_many': lambda: treatment_service.get_catalog().render_many([1, 2, 3]),
+        'TreatmentCatalog.page': lambda: treatment_service.get_catalog().page('angst', limit=10),
+    }
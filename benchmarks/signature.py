@@ -0,0 +1,68 @@
+"""
+Benchmark of the launch token signature verification, compares the verifications per second of each
+algorithm for the python-jose backends, and the native cryptography keys of the algorithms python-jose lacks.
+
+python -m benchmarks.signature --seconds=1
+"""
+import time
+import typing
+
+import fire
+from jose import jwk
+
+from application.hti.crypto import NATIVE_ALGORITHMS, NativeKey, pem_to_jwk
+from tests.conftest import sign
+
+SIGNING_INPUT = b'eyJhbGciOiJSUzUxMiJ9.eyJpc3MiOiJodHRwczovL3BvcnRhbC5leGFtcGxlLmNvbSJ9'
+
+
+def _backends(alg: str, pem: str) -> typing.Dict[str, typing.Any]:
+    """
+    Constructs the key of the algorithm for every available backend.
+    """
+    if alg in NATIVE_ALGORITHMS:
+        return {'native': NativeKey(pem_to_jwk(pem, alg), alg)}
+    backends = {'python-jose': jwk.construct(pem, alg)}
+    try:
+        if alg.startswith('RS'):
+            from jose.backends.rsa_backend import RSAKey
+            backends['python-jose (pure python)'] = RSAKey(pem, alg)
+        elif alg.startswith('ES'):
+            from jose.backends.ecdsa_backend import ECDSAECKey
+            backends['python-jose (pure python)'] = ECDSAECKey(pem, alg)
+    except ImportError:
+        pass
+    return backends
+
+
+def measure(key, signature: bytes, seconds: float) -> float:
+    """
+    Verifies the signature repeatedly for the given number of seconds.
+    :return: the verifications per second.
+    """
+    assert key.verify(SIGNING_INPUT, signature)
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(10):
+            key.verify(SIGNING_INPUT, signature)
+        count += 10
+    return count / (time.perf_counter() - start)
+
+
+def main(seconds: float = 1.0, algorithms: str = 'RS256,RS512,PS256,ES256,ES384,EdDSA'):
+    """
+    Runs the benchmark and prints a table of verifications per second.
+    :param seconds: the duration of each measurement.
+    :param algorithms: comma separated list of algorithms.
+    """
+    print(f'{"algorithm":<10} {"backend":<28} {"verifications/s":>16}')
+    for alg in algorithms.split(','):
+        pem, signature = sign(alg, SIGNING_INPUT)
+        for backend, key in _backends(alg, pem).items():
+            print(f'{alg:<10} {backend:<28} {measure(key, signature, seconds):>16,.0f}')
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
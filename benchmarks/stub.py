@@ -0,0 +1,111 @@
+"""
+A local stand-in for a portal application: it signs HTI launch tokens and serves its public key at
+/.well-known/jwks.json, so that benchmarks and load tests do not depend on a real portal.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jose import jwk, jwt
+from jose.constants import ALGORITHMS
+
+KEY_FILE = os.path.join(os.path.dirname(__file__), 'resources', 'portal.key')
+
+TASK = {
+    'resourceType': 'Task',
+    'id': '8c83a9ae',
+    'definitionReference': {
+        'reference': 'ActivityDefinition/2'
+    },
+    'status': 'requested',
+    'intent': 'plan',
+    'for': {
+        'reference': 'Person/fa1636df'
+    }
+}
+
+
+class StubPortal:
+    """
+    The stand-in portal, its issuer (iss) is the URL of the JWKS server.
+    """
+
+    def __init__(self, key_file: str = KEY_FILE, kid: str = 'stub-portal', host: str = '127.0.0.1', port: int = 0):
+        with open(key_file, 'rt') as file:
+            self.private_key = file.read()
+        self.kid = kid
+        public_key = jwk.construct(self.private_key, ALGORITHMS.RS512).public_key().to_dict()
+        public_key['kid'] = kid
+        self.jwks = json.dumps({'keys': [public_key]}).encode('utf8')
+        self.requests = 0
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """
+            Serves the JWKS with keep-alive.
+            """
+            protocol_version = 'HTTP/1.1'
+            # buffer the headers and the body into a single write, the response is flushed per request
+            wbufsize = -1
+
+            # pylint: disable=C0103
+            def do_GET(self):
+                portal.requests += 1
+                if self.path != '/.well-known/jwks.json':
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(portal.jwks)))
+                self.send_header('Cache-Control', 'public, max-age=3600')
+                self.end_headers()
+                self.wfile.write(portal.jwks)
+
+            # pylint: disable=W0622
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def issuer(self) -> str:
+        """
+        The issuer (iss) of the tokens, the JWKS is discovered at <issuer>/.well-known/jwks.json
+        """
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'StubPortal':
+        """
+        Starts serving the JWKS in a background thread.
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, name='stub-portal', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving the JWKS.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def token(self, audience: str, task: dict = None, lifetime: int = 3600) -> str:
+        """
+        Signs a launch token with a unique JWT Id (jti).
+        :param audience: the audience (aud), the host of the module.
+        :param task: the FHIR Task, defaults to a task for treatment 2.
+        :param lifetime: the number of seconds before the token expires.
+        :return: the encoded token.
+        """
+        return jwt.encode({'iss': self.issuer,
+                           'aud': audience,
+                           'jti': str(uuid.uuid4()),
+                           'exp': int(time.time()) + lifetime,
+                           'task': task or TASK}, self.private_key, algorithm=ALGORITHMS.RS512,
+                          headers={'kid': self.kid})
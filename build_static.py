@@ -0,0 +1,16 @@
+"""
+Script to build the static assets of the single page interface: fingerprinted css and js files with gzip and,
+if the brotli package is installed, brotli compressed variants, and the index.html that refers to them.
+"""
+import os
+
+from application.spi.assets import brotli, build_assets
+
+STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'application', 'spi', 'static')
+
+if __name__ == '__main__':
+    manifest = build_assets(STATIC)
+    for path, fingerprinted in manifest.items():
+        print(f'{path} -> {fingerprinted}')
+    if brotli is None:
+        print('The brotli package is not installed, only the gzip variants were built')
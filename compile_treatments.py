@@ -0,0 +1,28 @@
+"""
+Script to compile the treatments file into the JSON snapshot that is loaded at startup, run it at image build
+time so that the containers do not parse the YAML on a cold start.
+"""
+import os
+
+import fire
+
+from application.treatment.compiled import compile_treatments, snapshot_path_of
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'application', 'treatment', 'resources')
+
+
+def main(treatment_file: str = os.environ.get('TREATMENT_FILE', 'treatments.yaml'),
+         snapshot_file: str = os.environ.get('TREATMENT_SNAPSHOT_FILE', '')):
+    """
+    Compiles the treatments file.
+    :param treatment_file: the treatments file, relative to application/treatment/resources.
+    :param snapshot_file: the snapshot file, relative to the directory of the treatments file.
+    """
+    path = os.path.join(RESOURCES, treatment_file)
+    snapshot_path = snapshot_path_of(path, snapshot_file)
+    count = compile_treatments(path, snapshot_path)
+    print(f'Compiled {count} treatments from {path} into {snapshot_path}')
+
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -3,7 +3,10 @@ Server module for running this application with Docker
 """
 from waitress import serve
 
-from application import create_app
+from application import app, start_app
 from init_database import init_database
+from instance.config import envget_int
 
-serve(init_database(create_app()), host='0.0.0.0', port=8080)
+init_database(app)
+start_app(app)
+serve(app, host='0.0.0.0', port=envget_int('PORT', 8080), threads=envget_int('WAITRESS_THREADS', 4))
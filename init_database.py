@@ -1,16 +1,36 @@
 """
-Script to initialize a clean database.
+Script to initialize a clean database, or to upgrade the database of an earlier version.
 """
+from sqlalchemy import inspect
 
 from application.database import db
+from application.hti.models import JwtId
 
 
 def init_database(app):
     with app.app_context():
         db.create_all()
+        upgrade_database()
     return app
 
 
+def upgrade_database():
+    """
+    Adds the columns that create_all does not add to the existing tables of an earlier version.
+    """
+    table = JwtId.__table__
+    columns = [column['name'] for column in inspect(db.engine).get_columns(table.name)]
+    if 'exp' not in columns:
+        # the expiration time (exp) of the JTIs, the JTIs stored before are stamped by the purge job
+        column = table.c.exp
+        with db.engine.begin() as connection:
+            connection.execute(f'ALTER TABLE {table.name} ADD COLUMN {column.name} '
+                               f'{column.type.compile(db.engine.dialect)}')
+            for index in table.indexes:
+                if column in index.columns.values():
+                    index.create(connection)
+
+
 if __name__ == '__main__':
     from application import app
 
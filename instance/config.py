@@ -26,6 +26,26 @@ def envget_bool(key, dflt: bool) -> bool:
     return val.lower() in ['true', 'yes', '1', 'y']
 
 
+def envget_int(key, dflt: int) -> int:
+    """
+    Gets a value from the os.environ, and defaults to the value of dflt if not set in the environment.
+    :param key: environment variable name
+    :param dflt: default value, if not present in the environment
+    :return: either the value of the environment variable or the default value (dflt)
+    """
+    return int(envget_str(key, str(dflt)))
+
+
+def envget_float(key, dflt: float) -> float:
+    """
+    Gets a value from the os.environ, and defaults to the value of dflt if not set in the environment.
+    :param key: environment variable name
+    :param dflt: default value, if not present in the environment
+    :return: either the value of the environment variable or the default value (dflt)
+    """
+    return float(envget_str(key, str(dflt)))
+
+
 DEBUG = envget_bool('DEBUG', False)
 SQLALCHEMY_TRACK_MODIFICATIONS = envget_bool('SQLALCHEMY_TRACK_MODIFICATIONS', False)
 SQLALCHEMY_ECHO = envget_bool('SQLALCHEMY_ECHO', False)
@@ -33,4 +53,91 @@ SQLALCHEMY_ECHO = envget_bool('SQLALCHEMY_ECHO', False)
 APP_SECRET_KEY = envget_str('APP_SECRET_KEY', str(uuid.uuid1()))
 HTI_ALLOWED_PORTALS = envget_str('HTI_ALLOWED_PORTALS',
                                  'localhost:8080, gids-hti-ri-portal-java.edia-tst.eu, gids-hti-portal.edia-tst.eu')
+# The allowed signature algorithms of the launch tokens, defaults to RS256-RS512, PS256-PS512, ES256-ES512 and EdDSA.
+HTI_ALLOWED_ALGORITHMS = envget_str('HTI_ALLOWED_ALGORITHMS', '')
+# Optional YAML or JSON file that maps issuers to pinned keys, a jwks_url override and an audience, see IssuerRegistry.
+HTI_ISSUERS_FILE = envget_str('HTI_ISSUERS_FILE', '')
 SQLALCHEMY_DATABASE_URI = envget_str('SQLALCHEMY_DATABASE_URI', 'sqlite:///:memory:')
+
+# The session data is kept server side, the session cookie only carries the session id. SESSION_STORE is either memory,
+# a LRU cache of at most SESSION_CACHE_SIZE sessions per process, or sql, the application database, shared between
+# processes. A session expires SESSION_TTL seconds after the last request, the sql store deletes the expired sessions
+# every SESSION_PURGE_INTERVAL seconds.
+SESSION_STORE = envget_str('SESSION_STORE', 'memory')
+SESSION_TTL = envget_int('SESSION_TTL', 3600)
+SESSION_CACHE_SIZE = envget_int('SESSION_CACHE_SIZE', 10000)
+SESSION_PURGE_INTERVAL = envget_int('SESSION_PURGE_INTERVAL', 300)
+
+# The JWKS key sets are cached for HTI_JWKS_CACHE_TTL seconds, or for the max-age of the Cache-Control header of the
+# portal, with a maximum of HTI_JWKS_CACHE_MAX_TTL seconds. At most HTI_JWKS_CACHE_SIZE key sets are kept.
+HTI_JWKS_CACHE_TTL = envget_int('HTI_JWKS_CACHE_TTL', 300)
+HTI_JWKS_CACHE_MAX_TTL = envget_int('HTI_JWKS_CACHE_MAX_TTL', 3600)
+HTI_JWKS_CACHE_SIZE = envget_int('HTI_JWKS_CACHE_SIZE', 64)
+# The key sets of the allowed portals are prefetched at startup and refreshed every HTI_JWKS_REFRESH_INTERVAL seconds
+# when they expire within HTI_JWKS_REFRESH_AHEAD seconds. When a portal cannot be reached, its last known good key set is
+# served for at most HTI_JWKS_MAX_STALENESS seconds after expiry, retrying the portal every HTI_JWKS_RETRY_AFTER seconds.
+HTI_JWKS_REFRESH_ENABLED = envget_bool('HTI_JWKS_REFRESH_ENABLED', True)
+HTI_JWKS_REFRESH_INTERVAL = envget_int('HTI_JWKS_REFRESH_INTERVAL', 60)
+HTI_JWKS_REFRESH_AHEAD = envget_int('HTI_JWKS_REFRESH_AHEAD', 120)
+HTI_JWKS_MAX_STALENESS = envget_int('HTI_JWKS_MAX_STALENESS', 3600)
+HTI_JWKS_RETRY_AFTER = envget_int('HTI_JWKS_RETRY_AFTER', 30)
+# Concurrent fetches of the same jwks.json are coalesced, the waiting requests fail after HTI_JWKS_FETCH_WAIT_TIMEOUT seconds.
+HTI_JWKS_FETCH_WAIT_TIMEOUT = envget_int('HTI_JWKS_FETCH_WAIT_TIMEOUT', 10)
+
+# Launch tokens longer than HTI_MAX_TOKEN_LENGTH characters are rejected before they are decoded.
+HTI_MAX_TOKEN_LENGTH = envget_int('HTI_MAX_TOKEN_LENGTH', 16384)
+# Rejected tokens of unknown issuers and unknown key ids (kid) are remembered for HTI_NEGATIVE_CACHE_TTL seconds, for at
+# most HTI_NEGATIVE_CACHE_SIZE entries. A valid key set is refreshed for an unknown kid once per HTI_JWKS_MIN_REFRESH_INTERVAL.
+HTI_NEGATIVE_CACHE_TTL = envget_int('HTI_NEGATIVE_CACHE_TTL', 60)
+HTI_NEGATIVE_CACHE_SIZE = envget_int('HTI_NEGATIVE_CACHE_SIZE', 1024)
+HTI_JWKS_MIN_REFRESH_INTERVAL = envget_int('HTI_JWKS_MIN_REFRESH_INTERVAL', 10)
+
+# The outbound HTTP client keeps at most HTTP_POOL_SIZE idle connections per host. Failed calls are retried HTTP_RETRIES
+# times, with an exponential backoff starting at HTTP_RETRY_BACKOFF seconds. HTTP_READ_TIMEOUT applies to every socket
+# read, HTTP_DEADLINE bounds a call with all its attempts. Redirects are not followed: a 3xx response fails the call, so
+# configure the final URL of a jwks endpoint. Proxy settings (HTTPS_PROXY, NO_PROXY) are not used.
+HTTP_CONNECT_TIMEOUT = envget_float('HTTP_CONNECT_TIMEOUT', 2.0)
+HTTP_READ_TIMEOUT = envget_float('HTTP_READ_TIMEOUT', 5.0)
+HTTP_DEADLINE = envget_float('HTTP_DEADLINE', 10.0)
+HTTP_MAX_RESPONSE_SIZE = envget_int('HTTP_MAX_RESPONSE_SIZE', 1048576)
+HTTP_RETRIES = envget_int('HTTP_RETRIES', 2)
+HTTP_RETRY_BACKOFF = envget_float('HTTP_RETRY_BACKOFF', 0.1)
+HTTP_POOL_SIZE = envget_int('HTTP_POOL_SIZE', 4)
+
+# The JWT Ids (JTI) are purged every HTI_JTI_PURGE_INTERVAL seconds (0 disables the purge) once they are expired for
+# more than HTI_JTI_CLOCK_SKEW seconds, in batches of HTI_JTI_PURGE_BATCH_SIZE. The JTIs stored before the exp column
+# was added expire at the first run, and are purged by a later run.
+HTI_JTI_PURGE_INTERVAL = envget_int('HTI_JTI_PURGE_INTERVAL', 300)
+HTI_JTI_CLOCK_SKEW = envget_int('HTI_JTI_CLOCK_SKEW', 300)
+HTI_JTI_PURGE_BATCH_SIZE = envget_int('HTI_JTI_PURGE_BATCH_SIZE', 1000)
+
+# The treatments of treatments.yaml are synchronized with the database at startup, or on first use without
+# TREATMENT_EAGER_INIT, in batches of at most TREATMENT_SYNC_BATCH_SIZE rows. With TREATMENT_SYNC_DELETE, the
+# treatments that are not in the file are deleted.
+TREATMENT_EAGER_INIT = envget_bool('TREATMENT_EAGER_INIT', True)
+TREATMENT_SYNC_DELETE = envget_bool('TREATMENT_SYNC_DELETE', False)
+TREATMENT_SYNC_BATCH_SIZE = envget_int('TREATMENT_SYNC_BATCH_SIZE', 500)
+# The treatments file, relative to application/treatment/resources, is checked for changes every
+# TREATMENT_RELOAD_INTERVAL seconds (0 disables the reload) and reloaded without a restart.
+TREATMENT_FILE = envget_str('TREATMENT_FILE', 'treatments.yaml')
+TREATMENT_RELOAD_INTERVAL = envget_int('TREATMENT_RELOAD_INTERVAL', 10)
+# The parsed treatments are cached in a JSON snapshot, keyed by the hash of the treatments file, in the
+# TREATMENT_SNAPSHOT_FILE next to the treatments file, which defaults to <TREATMENT_FILE>.json.
+TREATMENT_SNAPSHOT_ENABLED = envget_bool('TREATMENT_SNAPSHOT_ENABLED', True)
+TREATMENT_SNAPSHOT_FILE = envget_str('TREATMENT_SNAPSHOT_FILE', '')
+# The pages of /api/treatment/all hold at most TREATMENT_PAGE_MAX_LIMIT treatments, /api/treatment?ids= gets at most
+# TREATMENT_BATCH_MAX_SIZE treatments.
+TREATMENT_PAGE_MAX_LIMIT = envget_int('TREATMENT_PAGE_MAX_LIMIT', 100)
+TREATMENT_BATCH_MAX_SIZE = envget_int('TREATMENT_BATCH_MAX_SIZE', 100)
+
+# The Cache-Control headers of the treatment and user API responses. The responses have an ETag, a client that
+# revalidates with If-None-Match gets a 304 Not Modified without the body.
+TREATMENT_CACHE_CONTROL = envget_str('TREATMENT_CACHE_CONTROL', 'private, no-cache')
+USER_CACHE_CONTROL = envget_str('USER_CACHE_CONTROL', 'private, no-cache')
+
+# The static files of the spi are served from SPI_STATIC_FOLDER, relative to application/spi or absolute.
+SPI_STATIC_FOLDER = envget_str('SPI_STATIC_FOLDER', 'static')
+# The static files of the spi, like index.html and the error pages, are kept in memory with SPI_PRELOAD_STATIC. The
+# files are checked for changes at most once per SPI_STATIC_CHECK_INTERVAL seconds.
+SPI_PRELOAD_STATIC = envget_bool('SPI_PRELOAD_STATIC', True)
+SPI_STATIC_CHECK_INTERVAL = envget_float('SPI_STATIC_CHECK_INTERVAL', 2.0)
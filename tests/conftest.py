@@ -1,11 +1,107 @@
 """
 Test configuration and fixtures.
 """
+import json
+from datetime import datetime, timedelta
+from uuid import uuid1
 
 import flask
 import pytest
+from Crypto.PublicKey import RSA
+from Crypto.PublicKey.RSA import RsaKey
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from jose import jwk, jwt
+from jose.constants import ALGORITHMS
+from pytest_mock import MockFixture
 
 from application import create_app
+from application.hti.context import LaunchContext
+from application.http_client import HttpResponse, http_client
+
+TEST_CONFIG = {'TESTING': True,
+               'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',
+               'SQLALCHEMY_TRACK_MODIFICATIONS': False}
+
+
+def create_test_app(config: dict = None) -> flask.Flask:
+    """
+    Creates an app with an in-memory database.
+    :param config: the configuration on top of TEST_CONFIG.
+    :return: the app.
+    """
+    return create_app({**TEST_CONFIG, **(config or {})})
+
+
+def sign(alg: str, data: bytes) -> (str, bytes):
+    """
+    Generates a key pair for the algorithm and signs the data.
+    :return: the PEM encoded public key and the signature.
+    """
+    if alg[:2] in ('RS', 'PS'):
+        private_key = rsa.generate_private_key(65537, 2048)
+        digest = getattr(hashes, f'SHA{alg[2:]}')()
+        pad = padding.PKCS1v15() if alg.startswith('RS') else padding.PSS(padding.MGF1(digest), digest.digest_size)
+        signature = private_key.sign(data, pad, digest)
+    elif alg.startswith('ES'):
+        curve = {'ES256': ec.SECP256R1(), 'ES384': ec.SECP384R1(), 'ES512': ec.SECP521R1()}[alg]
+        private_key = ec.generate_private_key(curve)
+        r, s = decode_dss_signature(private_key.sign(data, ec.ECDSA(getattr(hashes, f'SHA{alg[2:]}')())))
+        length = (curve.key_size + 7) // 8
+        signature = r.to_bytes(length, 'big') + s.to_bytes(length, 'big')
+    else:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        signature = private_key.sign(data)
+    pem = private_key.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo).decode('utf8')
+    return pem, signature
+
+
+class JwksStub:
+    """
+    The key set of the portal, served in place of the outbound calls of the http client.
+    """
+
+    def __init__(self, key_pair: RsaKey, kid: str):
+        self.key_pair = key_pair
+        self.kid = kid
+        self.headers = {}
+        self.calls = []
+
+    def get(self, url):
+        self.calls.append(url)
+        key = jwk.construct(self.key_pair.publickey().export_key(), ALGORITHMS.RS512).to_dict()
+        key['kid'] = self.kid
+        return HttpResponse(200, self.headers, json.dumps({'keys': [key]}).encode('UTF8'))
+
+    def token(self, task, kid: str = None) -> str:
+        """
+        A launch token of the portal, signed with the key pair of the key set.
+        :param task: the task claim.
+        :param kid: the key id (kid) of the token, defaults to the kid of the key set.
+        :return: the token.
+        """
+        return jwt.encode({'iss': 'https://localhost:8080',
+                           'aud': 'localhost',
+                           'jti': str(uuid1()),
+                           'exp': datetime.utcnow() + timedelta(seconds=30),
+                           'task': task}, self.key_pair.export_key(), algorithm=ALGORITHMS.RS512,
+                          headers={'kid': kid or self.kid})
+
+
+@pytest.fixture(scope='session')
+def portal_key() -> RsaKey:
+    """The key pair of the portal, generated once."""
+    return RSA.generate(2048)
+
+
+@pytest.fixture
+def jwks(portal_key: RsaKey, mocker: MockFixture) -> JwksStub:
+    """The key set of the portal, with a new key id (kid) per test."""
+    stub = JwksStub(portal_key, str(uuid1()))
+    mocker.patch.object(http_client, 'get', new=stub.get)
+    return stub
 
 
 @pytest.fixture
@@ -15,12 +111,9 @@ def app():
     :return:
     """
     from application.database import db
-    app = create_app({"TESTING": True,
-                      "SQLALCHEMY_DATABASE_URI": 'sqlite:///:memory:',
-                      'SECRET_KEY': 's3cr3t!',
-                      'SQLALCHEMY_ECHO': False,
-                      'HTI_ALLOWED_PORTALS': 'https://localhost:8080',
-                      'SQLALCHEMY_TRACK_MODIFICATIONS': False})
+    app = create_test_app({'SECRET_KEY': 's3cr3t!',
+                           'SQLALCHEMY_ECHO': False,
+                           'HTI_ALLOWED_PORTALS': 'https://localhost:8080'})
     with app.app_context():
         db.create_all()
     return app
@@ -44,21 +137,10 @@ class AuthActions(object):
 
     def login(self):
         with self._client.session_transaction() as sess:
-            sess['task'] = {
-                "resourceType": "Task",
-                "id": "8c83a9ae",
-                "definitionReference": {
-                    "reference": "ActivityDefinition/2"
-                },
-                "status": "requested",
-                "intent": "plan",
-                "for": {
-                    "reference": "Person/fa1636df"
-                }
-            }
+            sess['launch'] = LaunchContext(treatment_id=2, user_reference='Person/fa1636df', task_id='8c83a9ae')
 
     def logout(self):
-        flask.session['task'] = None
+        flask.session['launch'] = None
 
 
 @pytest.fixture
@@ -0,0 +1,128 @@
+import gzip
+import os
+import shutil
+
+import brotli
+import pytest
+from flask.testing import FlaskClient
+
+from application.spi import views
+from application.spi.assets import DIST, IMMUTABLE, StaticBundle, build_assets, fingerprint, rewrite_references
+from tests.conftest import AuthActions, create_test_app
+
+STATIC = os.path.dirname(views.__file__) + '/static'
+
+
+def test_rewrite_references():
+    manifest = {'css/styles.css': 'css/styles.1234.css', 'js/index.js': 'js/index.5678.js'}
+    html = '<link href="css/styles.css?v=1.0"><script src=\'js/index.js\'></script><script src="js/other.js">'
+    assert rewrite_references(html, manifest) == \
+           '<link href="css/styles.1234.css"><script src=\'js/index.5678.js\'></script><script src="js/other.js">'
+
+
+def test_build_assets(tmp_path):
+    static = tmp_path / 'static'
+    shutil.copytree(STATIC, static, ignore=shutil.ignore_patterns(DIST))
+    manifest = build_assets(str(static))
+
+    content = (static / 'css' / 'styles.css').read_bytes()
+    assert manifest['css/styles.css'] == fingerprint('css/styles.css', content)
+    assert (static / DIST / manifest['css/styles.css']).read_bytes() == content
+    assert gzip.decompress((static / DIST / (manifest['css/styles.css'] + '.gz')).read_bytes()) == content
+    assert manifest['js/materialize.min.js'] in (static / DIST / 'index.html').read_text()
+
+
+@pytest.fixture
+def built_client(tmp_path):
+    static = tmp_path / 'static'
+    shutil.copytree(STATIC, static, ignore=shutil.ignore_patterns(DIST))
+    manifest = build_assets(str(static))
+    app = create_test_app({'SPI_STATIC_FOLDER': str(static)})
+    return app.test_client(), manifest
+
+
+def test_fingerprinted_assets(built_client):
+    client, manifest = built_client
+    path = manifest['js/materialize.min.js']
+
+    response = client.get(path, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == IMMUTABLE
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert response.mimetype in ('application/javascript', 'text/javascript')
+    with open(os.path.join(STATIC, 'js', 'materialize.min.js'), 'rb') as file:
+        assert gzip.decompress(response.get_data()) == file.read()
+
+    response = client.get(path, headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    with open(os.path.join(STATIC, 'js', 'materialize.min.js'), 'rb') as file:
+        assert brotli.decompress(response.get_data()) == file.read()
+
+    response = client.get(path)
+    assert 'Content-Encoding' not in response.headers
+
+    response = client.get('css/styles.css')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] != IMMUTABLE
+
+
+def test_fingerprinted_index(built_client):
+    client, manifest = built_client
+    AuthActions(client).login()
+
+    response = client.get('index.html')
+    assert manifest['css/materialize.min.css'].encode('utf8') in response.get_data()
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+
+@pytest.fixture
+def preloaded_app():
+    app = create_test_app({'SPI_PRELOAD_STATIC': True})
+    return app
+
+
+def test_preloaded_error_pages(preloaded_app, mocker):
+    bundle = preloaded_app.blueprints['spi'].static_bundle
+    assert bundle.loaded
+    client = preloaded_app.test_client()
+    send_from_directory = mocker.patch.object(views, 'send_from_directory')
+
+    response = client.get('/does-not-exist')
+    assert response.status_code == 404
+    with open(os.path.join(STATIC, '404.html'), 'rb') as file:
+        assert response.get_data() == file.read()
+    assert response.headers['ETag'] == f'"{bundle.get("404.html").etag}"'
+    assert response.content_length == len(response.get_data())
+
+    response = client.get('/403.html', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 403
+
+    AuthActions(client).login()
+    response = client.get('index.html')
+    assert response.status_code == 200
+    assert client.get('index.html', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    response = client.get('css/styles.css')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/css'
+    assert send_from_directory.call_count == 0
+
+
+def test_bundle_reload(tmp_path):
+    (tmp_path / 'index.html').write_bytes(b'first')
+    bundle = StaticBundle(str(tmp_path))
+    assert bundle.get('index.html') is None
+    bundle.load(check_interval=0)
+    assert bundle.get('index.html').body == b'first'
+
+    (tmp_path / 'index.html').write_bytes(b'second')
+    (tmp_path / '404.html').write_bytes(b'missing')
+    bundle.check_interval = 3600
+    assert bundle.get('index.html').body == b'second'
+    assert bundle.get('404.html').body == b'missing'
+
+    # the next check is an hour away
+    (tmp_path / 'index.html').write_bytes(b'third')
+    assert bundle.get('index.html').body == b'second'
+    assert bundle.stats()['files'] == 2
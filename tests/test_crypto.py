@@ -0,0 +1,29 @@
+import pytest
+from jose.backends.base import Key
+from jose.exceptions import JWKError
+
+from application.hti.crypto import NATIVE_ALGORITHMS, NativeKey, construct_key, pem_to_jwk
+from tests.conftest import sign
+
+DATA = b'header.payload'
+
+
+@pytest.mark.parametrize('alg', ['RS256', 'RS512', 'PS256', 'ES256', 'ES384', 'ES512', 'EdDSA'])
+def test_verify(alg):
+    pem, signature = sign(alg, DATA)
+    key = construct_key(pem_to_jwk(pem, alg))
+
+    assert isinstance(key, NativeKey if alg in NATIVE_ALGORITHMS else Key)
+    assert key.verify(DATA, signature)
+    assert not key.verify(b'header.tampered', signature)
+
+
+def test_key_type_mismatch():
+    pem, _ = sign('ES256', DATA)
+
+    with pytest.raises(JWKError):
+        construct_key(pem_to_jwk(pem, 'ES256'), 'RS256')
+    with pytest.raises(JWKError):
+        construct_key(pem_to_jwk(pem, 'ES256'), 'ES384')
+    with pytest.raises(JWKError):
+        construct_key(pem_to_jwk(pem, 'ES256'), 'PS256')
@@ -0,0 +1,30 @@
+import time
+
+from sqlalchemy import inspect
+
+from application.database import db
+from application.hti.services import jti_purge_job, jwt_model_service
+from init_database import init_database
+from tests.conftest import create_test_app
+
+
+def test_upgrade_jwt_id(tmp_path):
+    app = create_test_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "upgrade.db"}',
+                           'HTI_JTI_CLOCK_SKEW': 0})
+    with app.app_context():
+        # the jwt_id table of an earlier version, without the expiration time
+        db.engine.execute('DROP TABLE jwt_id')
+        db.engine.execute('CREATE TABLE jwt_id (id VARCHAR(256) NOT NULL, PRIMARY KEY (id))')
+        db.engine.execute("INSERT INTO jwt_id (id) VALUES ('legacy')")
+
+    init_database(app)
+    init_database(app)
+
+    with app.app_context():
+        assert 'ix_jwt_id_exp' in [index['name'] for index in inspect(db.engine).get_indexes('jwt_id')]
+        assert jwt_model_service.register_jti('expired', int(time.time()) - 600)
+        assert jti_purge_job.run() == 1
+        assert jwt_model_service.count_jti() == 1
+        time.sleep(1.1)
+        assert jti_purge_job.run() == 1
+        assert jwt_model_service.count_jti() == 0
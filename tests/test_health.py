@@ -8,3 +8,10 @@ def test_index(client: FlaskClient, auth: AuthActions):
     assert response.status_code == 200
 
     assert response.json['status'] == 'OK'
+
+
+def test_metrics(client: FlaskClient):
+    response = client.get("/health/metrics")
+    assert response.status_code == 200
+
+    assert 'hits' in response.json['jwks_cache']
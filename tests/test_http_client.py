@@ -0,0 +1,168 @@
+import os
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from application.http_client import HttpClient, HttpError
+
+RESOURCES = os.path.join(os.path.dirname(__file__), 'resources')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path == '/flaky' and len(self.server.requests) < 3:
+            body, status = b'unavailable', 503
+        elif self.path == '/large':
+            body, status = b'x' * 2048, 200
+        elif self.path == '/slow':
+            time.sleep(0.5)
+            body, status = b'{}', 200
+        elif self.path == '/trickle':
+            self.send_response(200)
+            self.send_header('Content-Length', '10')
+            self.end_headers()
+            for _ in range(10):
+                # every byte arrives within the read timeout, the whole body does not
+                time.sleep(0.1)
+                self.wfile.write(b'x')
+                self.wfile.flush()
+            return
+        elif self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        elif self.path == '/malformed':
+            self.send_response(200)
+            self.send_header('Content-Length', 'many')
+            self.end_headers()
+            self.wfile.write(b'{}')
+            self.close_connection = True
+            return
+        else:
+            body, status = b'{"keys": []}', 200
+        if self.path == '/close':
+            # close the connection without announcing it, like a portal that closes an idle connection
+            self.close_connection = True
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.requests = []
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(os.path.join(RESOURCES, 'localhost.crt'), os.path.join(RESOURCES, 'localhost.key'))
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client():
+    context = ssl.create_default_context(cafile=os.path.join(RESOURCES, 'localhost.crt'))
+    client = HttpClient(connect_timeout=1, read_timeout=0.2, max_response_size=1024, retry_backoff=0.01,
+                        ssl_context=context)
+    yield client
+    client.close()
+
+
+def test_keep_alive(stub_server, client: HttpClient):
+    url = f'https://localhost:{stub_server.server_port}/.well-known/jwks.json'
+    for _ in range(3):
+        response = client.get(url)
+        assert response.status == 200
+        assert response.body == b'{"keys": []}'
+
+    assert stub_server.connections == 1
+    assert client.stats()['reused'] == 2
+
+
+def test_retry_with_backoff(stub_server, client: HttpClient):
+    response = client.get(f'https://localhost:{stub_server.server_port}/flaky')
+
+    assert response.status == 200
+    assert len(stub_server.requests) == 3
+    assert client.stats()['failures'] == 2
+
+
+def test_response_size_cap(stub_server, client: HttpClient):
+    with pytest.raises(HttpError):
+        client.get(f'https://localhost:{stub_server.server_port}/large')
+
+
+def test_read_timeout(stub_server, client: HttpClient):
+    client.retries = 0
+    with pytest.raises(HttpError):
+        client.get(f'https://localhost:{stub_server.server_port}/slow')
+
+
+def test_reused_connection_closed_by_server(stub_server, client: HttpClient):
+    client.retries = 0
+    client.get(f'https://localhost:{stub_server.server_port}/close')
+    response = client.get(f'https://localhost:{stub_server.server_port}/')
+
+    assert response.status == 200
+    assert stub_server.connections == 2
+    assert client.stats()['failures'] == 0
+
+
+def test_read_timeout_on_reused_connection(stub_server, client: HttpClient):
+    client.retries = 0
+    client.get(f'https://localhost:{stub_server.server_port}/')
+    with pytest.raises(HttpError):
+        client.get(f'https://localhost:{stub_server.server_port}/slow')
+
+    # the timeout is not retried on a new connection
+    assert stub_server.requests == ['/', '/slow']
+    assert stub_server.connections == 1
+
+
+def test_unsupported_scheme(stub_server, client: HttpClient):
+    with pytest.raises(HttpError):
+        client.get(f'ftp://localhost:{stub_server.server_port}/')
+
+
+def test_deadline(stub_server, client: HttpClient):
+    client.deadline = 0.5
+    start = time.monotonic()
+    with pytest.raises(HttpError):
+        client.get(f'https://localhost:{stub_server.server_port}/trickle')
+
+    assert time.monotonic() - start < 0.9
+
+
+def test_redirect_is_rejected(stub_server, client: HttpClient):
+    with pytest.raises(HttpError) as error:
+        client.get(f'https://localhost:{stub_server.server_port}/redirect')
+
+    assert error.value.status_code == 302
+    assert stub_server.requests == ['/redirect']
+
+
+def test_malformed_content_length(stub_server, client: HttpClient):
+    with pytest.raises(HttpError):
+        client.get(f'https://localhost:{stub_server.server_port}/malformed')
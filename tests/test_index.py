@@ -19,6 +19,7 @@ def test_index(client: FlaskClient, auth: AuthActions):
 
     print(response)
     assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'private, no-cache'
 
 
 def test_error_pages(client: FlaskClient):
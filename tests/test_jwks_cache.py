@@ -0,0 +1,166 @@
+import json
+import threading
+import time
+
+import pytest
+from Crypto.PublicKey import RSA
+from jose import jwk
+from jose.constants import ALGORITHMS
+from pytest_mock import MockFixture
+
+from application.hti.cache import JwksCache, SingleFlight, parse_max_age
+from application.hti.services import jwks_discovery_service
+from application.http_client import HttpResponse, http_client
+from tests.conftest import create_test_app
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _jwk(kid):
+    key = jwk.construct(RSA.generate(2048).publickey().export_key(), ALGORITHMS.RS512).to_dict()
+    key['kid'] = kid
+    return key
+
+
+def test_parse_max_age():
+    assert parse_max_age(None) is None
+    assert parse_max_age('public') is None
+    assert parse_max_age('public, max-age=120') == 120
+    assert parse_max_age('no-store') == 0
+
+
+def test_cache_expiry_and_kid_miss():
+    clock = Clock()
+    cache = JwksCache(clock)
+    cache.put('https://portal/.well-known/jwks.json', [_jwk('a')], 60, 10)
+
+    assert cache.get_key('https://portal/.well-known/jwks.json', 'a', ALGORITHMS.RS512) is not None
+    assert cache.get_key('https://portal/.well-known/jwks.json', 'b', ALGORITHMS.RS512) is None
+    clock.now += 61
+    assert cache.get_key('https://portal/.well-known/jwks.json', 'a', ALGORITHMS.RS512) is None
+    assert cache.stats() == {'size': 1, 'hits': 1, 'misses': 2, 'evictions': 0, 'stale_serves': 0}
+
+
+def test_cache_lru_eviction():
+    cache = JwksCache(Clock())
+    key = _jwk('a')
+    cache.put('one', [key], 60, 2)
+    cache.put('two', [key], 60, 2)
+    assert cache.get_key('one', 'a', ALGORITHMS.RS512) is not None
+    cache.put('three', [key], 60, 2)
+
+    assert cache.get_key('two', 'a', ALGORITHMS.RS512) is None
+    assert cache.get_key('one', 'a', ALGORITHMS.RS512) is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_single_flight_coalesces():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    results = []
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        return 'jwks'
+
+    leader = threading.Thread(target=lambda: results.append(flight.do('url', fetch, 5)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('url', fetch, 5))) for _ in range(4)]
+    for follower in followers:
+        follower.start()
+    while flight.stats()['coalesced'] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+
+    assert results == ['jwks'] * 5
+    assert flight.stats() == {'in_flight': 0, 'calls': 1, 'coalesced': 4, 'timeouts': 0}
+
+
+def test_single_flight_timeout():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+
+    leader = threading.Thread(target=lambda: flight.do('url', fetch, 5))
+    leader.start()
+    started.wait(5)
+    with pytest.raises(TimeoutError):
+        flight.do('url', fetch, 0.01)
+    release.set()
+    leader.join(5)
+
+    assert flight.stats()['timeouts'] == 1
+
+
+def test_cache_serve_stale():
+    clock = Clock()
+    cache = JwksCache(clock)
+    cache.put('url', [_jwk('a')], 60, 10, max_staleness=300)
+    clock.now += 61
+
+    assert cache.get_key('url', 'a', ALGORITHMS.RS512) is None
+    assert cache.serve_stale('url', 30) is not None
+    assert cache.get_key('url', 'a', ALGORITHMS.RS512) is not None
+    clock.now += 300
+    assert cache.serve_stale('url', 30) is None
+    assert cache.stats()['stale_serves'] == 1
+
+
+def test_refresher_warm_up(mocker: MockFixture):
+    calls = []
+
+    def get(url):
+        calls.append(url)
+        return HttpResponse(200, {}, json.dumps({'keys': [_jwk('warm')]}).encode('UTF8'))
+
+    mocker.patch.object(http_client, 'get', new=get)
+    app = create_test_app({'HTI_ALLOWED_PORTALS': 'https://warmup.example.com',
+                           'HTI_JWKS_REFRESH_ENABLED': True,
+                           'HTI_JWKS_REFRESH_INTERVAL': 3600})
+    refresher = app.extensions['hti_jwks_refresher']
+    assert refresher.ready.wait(5)
+
+    assert calls == ['https://warmup.example.com/.well-known/jwks.json']
+    assert jwks_discovery_service.cache.get_key(calls[0], 'warm', ALGORITHMS.RS512) is not None
+    response = app.test_client().get('/health/ready')
+    assert response.status_code == 200
+    assert response.json['checks']['jwks']
+
+
+@pytest.mark.parametrize('body', [b'<html>Maintenance</html>', b'{"error": "no keys"}', b'{"keys": "none"}'])
+def test_refresher_malformed_jwks(mocker: MockFixture, body):
+    mocker.patch.object(http_client, 'get', return_value=HttpResponse(200, {}, body))
+    app = create_test_app({'HTI_ALLOWED_PORTALS': 'https://malformed.example.com',
+                           'HTI_JWKS_REFRESH_ENABLED': True,
+                           'HTI_JWKS_REFRESH_INTERVAL': 3600})
+    refresher = app.extensions['hti_jwks_refresher']
+    assert refresher.ready.wait(5)
+
+    assert refresher.stats()['failures'] == 1
+    assert refresher._thread.is_alive()
+    assert app.test_client().get('/health/ready').status_code == 200
+
+
+def test_refresh_malformed_jwks_serves_stale(app, mocker: MockFixture):
+    url = 'https://stale.example.com/.well-known/jwks.json'
+    jwks_discovery_service.cache.put(url, [_jwk('stale')], 0, 10, max_staleness=300)
+    mocker.patch.object(http_client, 'get', return_value=HttpResponse(200, {}, b'not json'))
+
+    with app.app_context():
+        entry = jwks_discovery_service.refresh(url)
+    assert 'stale' in entry.jwks
@@ -1,41 +1,38 @@
-import json
-from datetime import datetime, timedelta
+import time
 from uuid import uuid1
 
-from Crypto.PublicKey import RSA
-from Crypto.PublicKey.RSA import RsaKey
+import pytest
 from flask.testing import FlaskClient
-from jose import jwt, jwk
+from jose import jwt
 from jose.constants import ALGORITHMS
+from jose.exceptions import JWTClaimsError
 from pytest_mock import MockFixture
 
+from application.hti.cache import NegativeCache, RateLimiter
+from application.hti.context import LaunchContext
+from application.hti.models import JwtId
+from application.hti.services import hti_launch_service, hti_portal_service, jwks_discovery_service, \
+    jwt_model_service, jti_purge_job
+from tests.conftest import JwksStub
 
-def test_launch_error(client: FlaskClient):
-    response = client.post('/module_launch', data={'token': None})
-    assert response.status_code == 400
-
-
-def test_launch(client: FlaskClient, mocker: MockFixture):
-    ## urllib.request.urlopen
-    key_pair = RSA.generate(2048)
-    private_key = key_pair.export_key()
-    pair_publickey: RsaKey = key_pair.publickey()
-    public_key = pair_publickey.export_key()
-    kid = str(uuid1())
 
-    def urlopen(url):
-        key = jwk.construct(public_key, ALGORITHMS.RS512).to_dict()
-        key['kid'] = kid
-        data = json.dumps({'keys': [key]}).encode('UTF8')
+@pytest.fixture(autouse=True)
+def reset_services(mocker: MockFixture):
+    """
+    Starts every test with empty key set caches and negative caches, so that the tests do not depend on their order.
+    """
+    jwks_discovery_service.cache.clear()
+    mocker.patch.object(jwks_discovery_service, 'unknown_kids', new=NegativeCache())
+    mocker.patch.object(jwks_discovery_service, 'forced_refreshes', new=RateLimiter())
+    mocker.patch.object(hti_portal_service, 'rejections', new=NegativeCache())
 
-        class Stream:
-            def read(self):
-                return data
 
-        return Stream()
+def test_launch_error(client: FlaskClient):
+    response = client.post('/module_launch', data={'token': None})
+    assert response.status_code == 400
 
-    mocker.patch('application.hti.services.urlopen', new=urlopen)
 
+def test_launch(client: FlaskClient, jwks: JwksStub):
     task = {
         "resourceType": "Task",
         "id": "8c83a9ae",
@@ -48,14 +45,121 @@ def test_launch(client: FlaskClient, mocker: MockFixture):
             "reference": "Person/fa1636df"
         }
     }
-    token = jwt.encode({'iss': 'https://localhost:8080',
-                        'aud': 'localhost',
-                        'jti': str(uuid1()),
-                        'exp': datetime.utcnow() + timedelta(seconds=30),
-                        'task': task}, private_key, algorithm=ALGORITHMS.RS512, headers={'kid': kid})
+    token = jwks.token(task)
     response = client.post('/module_launch', data={'token': token})
     assert response.status_code == 302
 
     ## Replay
     response = client.post('/module_launch', data={'token': token})
     assert response.status_code == 400
+
+
+def test_launch_jwks_cached(client: FlaskClient, jwks: JwksStub):
+    jwks.headers = {'Cache-Control': 'public, max-age=60'}
+
+    task = {'resourceType': 'Task', 'id': '8c83a9ae',
+            'definitionReference': {'reference': 'ActivityDefinition/2'},
+            'for': {'reference': 'Person/fa1636df'}}
+    for _ in range(3):
+        response = client.post('/module_launch', data={'token': jwks.token(task)})
+        assert response.status_code == 302
+
+    assert jwks.calls == ['https://localhost:8080/.well-known/jwks.json']
+
+
+def test_register_jti(app):
+    jti = str(uuid1())
+    with app.app_context():
+        assert JwtId.query.get(jti) is None
+        assert jwt_model_service.register_jti(jti)
+        assert not jwt_model_service.register_jti(jti)
+        assert JwtId.query.get(jti) is not None
+
+
+def test_purge_jti(app):
+    now = int(time.time())
+    app.config['HTI_JTI_PURGE_BATCH_SIZE'] = 2
+    with app.app_context():
+        for index in range(5):
+            jwt_model_service.register_jti(f'expired-{index}', now - 600)
+        jwt_model_service.register_jti('skewed', now - 60)
+        jwt_model_service.register_jti('valid', now + 60)
+
+        assert jti_purge_job.run() == 5
+        assert jwt_model_service.count_jti() == 2
+        assert jti_purge_job.stats()['last_purged'] == 5
+        assert jti_purge_job.stats()['size'] == 2
+
+
+def test_purge_jti_without_exp(app):
+    app.config['HTI_JTI_CLOCK_SKEW'] = 0
+    with app.app_context():
+        jwt_model_service.register_jti('legacy')
+
+        # the first run sets the expiration time, a later run purges the JTI
+        assert jti_purge_job.run() == 0
+        assert JwtId.query.get('legacy') is not None
+        time.sleep(1.1)
+        assert jti_purge_job.run() == 1
+        assert JwtId.query.get('legacy') is None
+
+
+def test_launch_unknown_kid(client: FlaskClient, jwks: JwksStub):
+    jwks.kid = 'known'
+
+    for kid in ['unknown-1', 'unknown-1', 'unknown-2', 'unknown-3']:
+        assert client.post('/module_launch', data={'token': jwks.token({}, kid)}).status_code == 400
+
+    # the repeated unknown-1 is answered by the negative cache, unknown-2 forces a refresh of
+    # the valid key set and the forced refresh for unknown-3 is suppressed by the rate limit
+    assert len(jwks.calls) == 2
+    assert jwks_discovery_service.unknown_kids.stats()['hits'] == 1
+    assert jwks_discovery_service.forced_refreshes.stats() == {'allowed': 1, 'suppressed': 1}
+
+
+def test_launch_disallowed_issuer_cached(client: FlaskClient):
+    token = jwt.encode({'iss': 'https://evil.example.com', 'aud': 'localhost', 'jti': str(uuid1())},
+                       'secret', algorithm=ALGORITHMS.HS256)
+
+    assert client.post('/module_launch', data={'token': token}).status_code == 400
+    assert client.post('/module_launch', data={'token': token}).status_code == 400
+    assert hti_portal_service.rejections.stats()['hits'] == 1
+
+
+def test_launch_disallowed_algorithm(client: FlaskClient):
+    token = jwt.encode({'iss': 'https://localhost:8080', 'aud': 'localhost', 'jti': str(uuid1())},
+                       'secret', algorithm=ALGORITHMS.HS256)
+
+    assert client.post('/module_launch', data={'token': token}).status_code == 400
+
+
+def test_launch_token_too_long(client: FlaskClient, mocker: MockFixture):
+    launch = mocker.spy(hti_launch_service, 'launch')
+    token = jwt.encode({'iss': 'https://evil.example.com', 'aud': 'localhost', 'jti': str(uuid1()),
+                        'padding': 'x' * 16384}, 'secret', algorithm=ALGORITHMS.HS256)
+
+    assert client.post('/module_launch', data={'token': token}).status_code == 400
+    assert not launch.called
+
+
+@pytest.mark.parametrize('task', [None, {}, {'for': {'reference': 'Person/fa1636df'}},
+                                  {'definitionReference': {'reference': 'ActivityDefinition/x'},
+                                   'for': {'reference': 'Person/fa1636df'}},
+                                  {'definitionReference': {'reference': 'PlanDefinition/2'},
+                                   'for': {'reference': 'Person/fa1636df'}},
+                                  {'definitionReference': {'reference': 'ActivityDefinition/2'}, 'for': {}}])
+def test_launch_context_malformed_task(task):
+    with pytest.raises(JWTClaimsError):
+        LaunchContext.from_task(task)
+
+
+def test_launch_context():
+    context = LaunchContext.from_task({'id': '8c83a9ae',
+                                       'definitionReference': {'reference': 'ActivityDefinition/2'},
+                                       'for': {'reference': 'Person/fa1636df'}})
+    assert context == LaunchContext(treatment_id=2, user_reference='Person/fa1636df', task_id='8c83a9ae')
+
+
+def test_launch_malformed_task(client: FlaskClient, jwks: JwksStub):
+    token = jwks.token({'definitionReference': {'reference': 'ActivityDefinition/two'}})
+    assert client.post('/module_launch', data={'token': token}).status_code == 400
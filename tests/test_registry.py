@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+from uuid import uuid1
+
+import pytest
+from Crypto.PublicKey import RSA
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat, PublicFormat
+from jose import jwt
+from jose.constants import ALGORITHMS
+from pytest_mock import MockFixture
+
+from application.hti.registry import IssuerRegistry
+from application.http_client import http_client
+from tests.conftest import create_test_app
+
+KEY_PAIR = RSA.generate(2048)
+TASK = {'resourceType': 'Task', 'id': '8c83a9ae',
+        'definitionReference': {'reference': 'ActivityDefinition/2'},
+        'for': {'reference': 'Person/fa1636df'}}
+
+
+@pytest.fixture
+def pinned_client():
+    app = create_test_app({'SECRET_KEY': 's3cr3t!',
+                           'HTI_ALLOWED_PORTALS': 'https://localhost:8080',
+                           'HTI_ISSUERS': {'https://pinned.example.com': {
+                               'audience': 'module.example.com',
+                               'keys': [{'kid': 'pinned-1', 'pem': KEY_PAIR.publickey().export_key().decode('utf8')}]}}})
+    return app.test_client()
+
+
+def test_registry_from_config():
+    registry = IssuerRegistry.from_config({'HTI_ALLOWED_PORTALS': ' localhost:8080 , https://portal.example.com',
+                                           'HTI_ISSUERS': {'https://other.example.com': {
+                                               'jwks_url': 'https://keys.example.com/jwks.json'}}})
+
+    assert registry.is_allowed('localhost:8080')
+    assert not registry.is_allowed('example.com')
+    assert registry.get('localhost:8080').jwks_url == 'https://localhost:8080/.well-known/jwks.json'
+    assert registry.get('https://portal.example.com').jwks_url == 'https://portal.example.com/.well-known/jwks.json'
+    assert registry.get('https://other.example.com').jwks_url == 'https://keys.example.com/jwks.json'
+    assert registry.get('https://other.example.com').pinned is None
+
+
+def test_launch_pinned_key(pinned_client, mocker: MockFixture):
+    get = mocker.patch.object(http_client, 'get', side_effect=AssertionError('no network I/O expected'))
+    token = jwt.encode({'iss': 'https://pinned.example.com',
+                        'aud': 'module.example.com',
+                        'jti': str(uuid1()),
+                        'exp': datetime.utcnow() + timedelta(seconds=30),
+                        'task': TASK}, KEY_PAIR.export_key(), algorithm=ALGORITHMS.RS512, headers={'kid': 'pinned-1'})
+
+    response = pinned_client.post('/module_launch', data={'token': token})
+    assert response.status_code == 302
+    assert not get.called
+
+
+def test_launch_disallowed_issuer(pinned_client):
+    token = jwt.encode({'iss': 'https://evil.example.com',
+                        'aud': 'localhost',
+                        'jti': str(uuid1()),
+                        'exp': datetime.utcnow() + timedelta(seconds=30),
+                        'task': TASK}, KEY_PAIR.export_key(), algorithm=ALGORITHMS.RS512)
+
+    response = pinned_client.post('/module_launch', data={'token': token})
+    assert response.status_code == 400
+
+
+def test_launch_es256_pinned_key(mocker: MockFixture):
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    public_pem = private_key.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+    private_pem = private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+    app = create_test_app({'SECRET_KEY': 's3cr3t!',
+                           'HTI_ALLOWED_ALGORITHMS': 'ES256',
+                           'HTI_ISSUERS': {'https://ec.example.com': {
+                               'keys': [{'kid': 'ec-1', 'alg': 'ES256', 'pem': public_pem.decode('utf8')}]}}})
+    token = jwt.encode({'iss': 'https://ec.example.com',
+                        'aud': 'localhost',
+                        'jti': str(uuid1()),
+                        'exp': datetime.utcnow() + timedelta(seconds=30),
+                        'task': TASK}, private_pem.decode('utf8'), algorithm=ALGORITHMS.ES256, headers={'kid': 'ec-1'})
+
+    response = app.test_client().post('/module_launch', data={'token': token})
+    assert response.status_code == 302
+
+
+def test_pinned_pem_default_algorithm():
+    ec_pem = ec.generate_private_key(ec.SECP384R1()).public_key().public_bytes(Encoding.PEM,
+                                                                                PublicFormat.SubjectPublicKeyInfo)
+    ed_pem = ed25519.Ed25519PrivateKey.generate().public_key().public_bytes(Encoding.PEM,
+                                                                             PublicFormat.SubjectPublicKeyInfo)
+    registry = IssuerRegistry.from_config({'HTI_ISSUERS': {'https://portal.example.com': {
+        'keys': [{'kid': 'rsa', 'pem': KEY_PAIR.publickey().export_key().decode('utf8')},
+                 {'kid': 'ec', 'pem': ec_pem.decode('utf8')},
+                 {'kid': 'ed', 'pem': ed_pem.decode('utf8')}]}}})
+
+    jwks = registry.get('https://portal.example.com').pinned.jwks
+    assert jwks['rsa']['alg'] == ALGORITHMS.RS512
+    assert jwks['ec']['alg'] == ALGORITHMS.ES384
+    assert jwks['ed']['alg'] == 'EdDSA'
+
+
+def test_launch_ec_pinned_key_without_alg():
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    public_pem = private_key.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+    private_pem = private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+    app = create_test_app({'SECRET_KEY': 's3cr3t!',
+                           'HTI_ISSUERS': {'https://ec.example.com': {'keys': [public_pem.decode('utf8')]}}})
+    token = jwt.encode({'iss': 'https://ec.example.com',
+                        'aud': 'localhost',
+                        'jti': str(uuid1()),
+                        'exp': datetime.utcnow() + timedelta(seconds=30),
+                        'task': TASK}, private_pem.decode('utf8'), algorithm=ALGORITHMS.ES256)
+
+    response = app.test_client().post('/module_launch', data={'token': token})
+    assert response.status_code == 302
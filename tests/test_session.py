@@ -0,0 +1,95 @@
+from flask.testing import FlaskClient
+
+from application.database import db
+from application.hti.context import LaunchContext, current_launch
+from application.session import MemorySessionStore, SessionData, SqlSessionStore
+from tests.conftest import AuthActions, create_test_app
+
+
+def test_memory_store_lru_and_ttl():
+    now = [0.0]
+    store = MemorySessionStore(max_size=2, clock=lambda: now[0])
+    store.put('a', {'task': 1}, ttl=10)
+    store.put('b', {'task': 2}, ttl=10)
+    assert store.get('a') == {'task': 1}
+    store.put('c', {'task': 3}, ttl=10)
+    assert store.get('b') is None
+    now[0] = 11
+    assert store.get('a') is None
+    assert store.stats() == {'store': 'memory', 'size': 1, 'hits': 1, 'misses': 2, 'hit_rate': 1 / 3,
+                             'evictions': 1, 'expirations': 1}
+
+
+def test_active_session_outlives_ttl(client: FlaskClient, auth: AuthActions):
+    now = [0.0]
+    client.application.session_interface.store.clock = lambda: now[0]
+    client.application.session_interface.ttl = 10
+    auth.login()
+
+    for _ in range(3):
+        now[0] += 8
+        assert client.get('/api/user/current').status_code == 200
+    now[0] += 11
+    assert client.get('/api/user/current').status_code != 200
+
+
+def test_cookie_carries_session_id(client: FlaskClient, auth: AuthActions):
+    auth.login()
+    cookie = next(cookie for cookie in client.cookie_jar if cookie.name == 'session')
+    assert 'Person' not in cookie.value
+    assert len(cookie.value) < 64
+
+    response = client.get('/api/user/current')
+    assert response.status_code == 200
+
+    response = client.get('/health/metrics')
+    assert response.json['sessions']['hits'] >= 1
+
+
+def test_regenerate(app):
+    with app.test_request_context():
+        store = app.session_interface.store
+        store.put('old', {'task': {}}, ttl=10)
+        sess = app.session_interface.open_session(app, app.request_class({'HTTP_COOKIE': 'session=old'}))
+        assert sess['task'] == {}
+        sess.regenerate()
+        sess['task'] = {'id': 'new'}
+        response = app.response_class()
+        app.session_interface.save_session(app, sess, response)
+        assert sess.sid != 'old'
+        assert store.get('old') is None
+        assert store.get(sess.sid) == {'task': {'id': 'new'}}
+        assert sess.sid in response.headers['Set-Cookie']
+
+
+def test_sql_store():
+    app = create_test_app({'SESSION_STORE': 'sql'})
+    now = [1000.0]
+    store = app.session_interface.store
+    assert isinstance(store, SqlSessionStore)
+    store.clock = lambda: now[0]
+    with app.app_context():
+        db.create_all()
+        store.put('a', {'task': {'id': 'a'}}, ttl=10)
+        store.put('a', {'task': {'id': 'b'}}, ttl=10)
+        assert store.get('a') == {'task': {'id': 'b'}}
+        now[0] = 1011
+        assert store.get('a') is None
+        store.delete('a')
+
+        # an active session is extended once less than half of its time to live remains
+        store.put('b', {'task': {'id': 'b'}}, ttl=10)
+        for _ in range(3):
+            now[0] += 4
+            assert store.get('b', ttl=10) == {'task': {'id': 'b'}}
+        assert db.session.query(SessionData.expires_at).filter_by(id='b').scalar() == 1029
+        now[0] += 11
+        assert store.get('b', ttl=10) is None
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['launch'] = LaunchContext(2, 'Person/fa1636df', '8c83a9ae')
+    with client:
+        response = client.get('/api/user/current')
+        assert response.json['reference'] == 'Person/fa1636df'
+        assert current_launch() == LaunchContext(2, 'Person/fa1636df', '8c83a9ae')
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from uuid import uuid1
+
+import pytest
+from Crypto.PublicKey import RSA
+from jose import jwt, jwk
+from jose.constants import ALGORITHMS
+from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
+
+from application.hti.services import JWT_VALIDATION_OPTIONS
+from application.hti.token import ParsedToken
+
+KEY_PAIR = RSA.generate(2048)
+
+
+def _token(**claims):
+    payload = {'iss': 'https://localhost:8080',
+               'aud': 'localhost',
+               'jti': str(uuid1()),
+               'exp': datetime.utcnow() + timedelta(seconds=30)}
+    payload.update(claims)
+    payload = {claim: value for claim, value in payload.items() if value is not None}
+    return jwt.encode(payload, KEY_PAIR.export_key(), algorithm=ALGORITHMS.RS512, headers={'kid': 'kid-1'})
+
+
+def test_parse():
+    parsed = ParsedToken(_token())
+
+    assert parsed.issuer == 'https://localhost:8080'
+    assert parsed.kid == 'kid-1'
+    assert parsed.alg == ALGORITHMS.RS512
+
+
+def test_parse_malformed():
+    with pytest.raises(JWTError):
+        ParsedToken('not-a-token')
+    with pytest.raises(JWTError):
+        ParsedToken('bm90.anNvbg.c2ln')
+
+
+def test_verify():
+    key = jwk.construct(KEY_PAIR.publickey().export_key(), ALGORITHMS.RS512)
+    parsed = ParsedToken(_token(task={'id': '1'}))
+
+    claims = parsed.verify(key, JWT_VALIDATION_OPTIONS, audience='localhost', issuer='https://localhost:8080')
+    assert claims['task'] == {'id': '1'}
+
+    with pytest.raises(JWTClaimsError):
+        parsed.verify(key, JWT_VALIDATION_OPTIONS, audience='other', issuer='https://localhost:8080')
+
+
+def test_verify_signature():
+    other_key = jwk.construct(RSA.generate(2048).publickey().export_key(), ALGORITHMS.RS512)
+
+    with pytest.raises(JWTError):
+        ParsedToken(_token()).verify(other_key, JWT_VALIDATION_OPTIONS, audience='localhost',
+                                     issuer='https://localhost:8080')
+
+
+@pytest.mark.parametrize('claims, error, message', [
+    ({'aud': None}, JWTError, 'missing required key "aud"'),
+    ({'iss': None}, JWTError, 'missing required key "iss"'),
+    ({'jti': None}, JWTError, 'missing required key "jti"'),
+    ({'exp': None}, JWTError, 'missing required key "exp"'),
+    ({'exp': datetime.utcnow() - timedelta(seconds=30)}, ExpiredSignatureError, 'Signature has expired.'),
+    ({'aud': 'other'}, JWTClaimsError, 'Invalid audience'),
+    ({'iss': 'https://other'}, JWTClaimsError, 'Invalid issuer'),
+    ({'jti': 1}, JWTClaimsError, 'JWT ID must be a string.'),
+])
+def test_verify_claims(claims, error, message):
+    """
+    Pins the claim validation of the private jwt._validate_claims that ParsedToken.verify relies on.
+    """
+    key = jwk.construct(KEY_PAIR.publickey().export_key(), ALGORITHMS.RS512)
+
+    with pytest.raises(error, match=message) as raised:
+        ParsedToken(_token(**claims)).verify(key, JWT_VALIDATION_OPTIONS, audience='localhost',
+                                             issuer='https://localhost:8080')
+    assert type(raised.value) is error
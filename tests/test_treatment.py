@@ -1,6 +1,15 @@
+import json
+import os
+import threading
+
 from flask.testing import FlaskClient
 
-from tests.conftest import AuthActions
+from application.treatment import compiled
+from application.treatment.compiled import compile_treatments, load_treatments, snapshot_path_of
+from application.treatment.models import Treatment
+from application.treatment.search import TreatmentIndex
+from application.treatment.services import TreatmentCatalog, TreatmentService, TreatmentWatcher
+from tests.conftest import AuthActions, create_test_app
 
 
 def test_current(client: FlaskClient, auth: AuthActions):
@@ -25,3 +34,210 @@ def test_all(client: FlaskClient, auth: AuthActions):
     response = client.get('/api/treatment/all')
     assert response.status_code == 200
     assert len(response.json['treatments']) == 4
+
+    # a parameter that does not select a page returns all treatments
+    response = client.get('/api/treatment/all?_t=123')
+    assert response.status_code == 200
+    assert len(response.json['treatments']) == 4
+    assert 'total' not in response.json
+
+
+def test_sync(app):
+    treatments = [{'id': '1', 'name': 'One', 'description': 'First'},
+                  {'id': '2', 'name': 'Two', 'description': 'Second'}]
+    with app.app_context():
+        assert TreatmentService.sync(treatments) == {'inserted': 2, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        assert TreatmentService.sync(treatments) == {'inserted': 0, 'updated': 0, 'deleted': 0, 'unchanged': 2}
+
+        treatments[1] = {'id': '2', 'name': 'Two', 'description': 'Changed'}
+        treatments.append({'id': '3', 'name': 'Three', 'description': 'Third'})
+        assert TreatmentService.sync(treatments[1:], batch_size=1) == {'inserted': 1, 'updated': 1, 'deleted': 0,
+                                                                       'unchanged': 0}
+        assert TreatmentService.sync(treatments[1:], delete=True) == {'inserted': 0, 'updated': 0, 'deleted': 1,
+                                                                      'unchanged': 2}
+        assert [(treatment.id, treatment.description) for treatment in Treatment.query.order_by(Treatment.id)] == \
+               [(2, 'Changed'), (3, 'Third')]
+
+
+def test_get(client: FlaskClient, auth: AuthActions):
+    auth.login()
+
+    response = client.get('/api/treatment/3')
+    assert response.status_code == 200
+    assert response.json['id'] == 3
+    assert response.mimetype == 'application/json'
+
+    assert client.get('/api/treatment/99').status_code == 404
+
+
+def test_catalog_snapshot(app):
+    with app.app_context():
+        TreatmentService.sync([{'id': '1', 'name': 'One', 'description': 'First'}])
+        catalog = TreatmentCatalog()
+        snapshot = catalog.snapshot
+        assert dict(snapshot.treatments[1]) == {'id': 1, 'name': 'One', 'description': 'First'}
+        assert json.loads(snapshot.all_response) == {'treatments': [dict(snapshot.treatments[1])]}
+
+        TreatmentService.sync([{'id': '1', 'name': 'One', 'description': 'Changed'}])
+        assert catalog.snapshot is snapshot
+        refreshed = catalog.refresh()
+        assert catalog.snapshot is refreshed
+        assert json.loads(refreshed.responses[1])['description'] == 'Changed'
+        # the old snapshot is not changed by the refresh
+        assert snapshot.treatments[1]['description'] == 'First'
+        assert catalog.stats()['refreshes'] == 2
+
+
+def test_eager_init():
+    app = create_test_app({'TREATMENT_EAGER_INIT': True})
+    treatment_service = app.blueprints['treatment'].treatment_service
+    assert treatment_service.initialized
+    assert treatment_service.init_seconds is not None
+    with app.app_context():
+        assert not treatment_service.ensure_initialized()
+
+    response = app.test_client().get('/health/ready')
+    assert response.json['checks']['treatments']
+
+
+def test_lazy_init_once(app, mocker):
+    treatment_service = app.blueprints['treatment'].treatment_service
+    init = mocker.spy(treatment_service, 'init')
+    barrier = threading.Barrier(4)
+
+    def first_request():
+        with app.app_context():
+            barrier.wait()
+            treatment_service.get_catalog()
+
+    threads = [threading.Thread(target=first_request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert init.call_count == 1
+
+
+def test_watcher_reload(app, tmp_path):
+    path = tmp_path / 'treatments.yaml'
+    path.write_text('treatments:\n  - id: 1\n    name: One\n    description: First\n')
+    app.config['TREATMENT_FILE'] = str(path)
+    treatment_service = app.blueprints['treatment'].treatment_service
+    watcher = TreatmentWatcher(app, treatment_service)
+    with app.app_context():
+        treatment_service.ensure_initialized()
+        assert not watcher.check()
+
+        path.write_text('treatments:\n  - id: 1\n    name: One\n    description: Changed\n')
+        os.utime(path, ns=(0, 10 ** 9))
+        assert watcher.check()
+        assert treatment_service.get_catalog().treatments[1]['description'] == 'Changed'
+
+        path.write_text('treatments:\n  - id: 1\n    name: [One\n')
+        assert not watcher.check()
+        assert not watcher.check()
+        assert treatment_service.get_catalog().treatments[1]['description'] == 'Changed'
+
+    stats = watcher.stats()
+    assert (stats['checks'], stats['reloads'], stats['failures']) == (4, 1, 1)
+    assert stats['last_error']
+
+
+def test_compiled_snapshot(tmp_path, mocker):
+    path = tmp_path / 'treatments.yaml'
+    path.write_text('treatments:\n  - id: 1\n    name: One\n    description: First\n')
+    snapshot_path = snapshot_path_of(str(path))
+    assert snapshot_path == str(tmp_path / 'treatments.yaml.json')
+
+    assert load_treatments(str(path), snapshot_path) == ([{'id': '1', 'name': 'One', 'description': 'First'}], 'yaml')
+    yaml_load = mocker.spy(compiled.yaml, 'load')
+    assert load_treatments(str(path), snapshot_path)[1] == 'snapshot'
+    assert yaml_load.call_count == 0
+
+    # a change of the treatments file invalidates the snapshot
+    path.write_text('treatments:\n  - id: 1\n    name: One\n    description: Changed\n')
+    treatments, source = load_treatments(str(path), snapshot_path)
+    assert (treatments[0]['description'], source) == ('Changed', 'yaml')
+    assert load_treatments(str(path), snapshot_path)[1] == 'snapshot'
+
+    (tmp_path / 'treatments.yaml.json').write_text('{"version": 1, "sha')
+    assert load_treatments(str(path), snapshot_path)[1] == 'yaml'
+    assert compile_treatments(str(path), snapshot_path) == 1
+    assert load_treatments(str(path), snapshot_path)[1] == 'snapshot'
+
+
+def test_all_page(client: FlaskClient, auth: AuthActions):
+    auth.login()
+
+    response = client.get('/api/treatment/all?fields=id,name&limit=3')
+    assert response.status_code == 200
+    assert response.json['total'] == 4
+    assert [treatment['id'] for treatment in response.json['treatments']] == [1, 2, 3]
+    assert set(response.json['treatments'][0]) == {'id', 'name'}
+
+    response = client.get(f'/api/treatment/all?fields=id&limit=3&cursor={response.json["next_cursor"]}')
+    assert response.json['treatments'] == [{'id': 4}]
+    assert response.json['next_cursor'] is None
+
+    response = client.get('/api/treatment/all?offset=1&limit=1')
+    assert response.json['treatments'][0]['id'] == 2
+    assert response.json['next_cursor'] == '2'
+
+    assert client.get('/api/treatment/all?fields=secret').status_code == 400
+    assert client.get('/api/treatment/all?limit=-1').status_code == 400
+    assert client.get('/api/treatment/all?offset=x').status_code == 400
+
+
+def test_all_search(client: FlaskClient, auth: AuthActions):
+    auth.login()
+
+    response = client.get('/api/treatment/all?q=angst&fields=id')
+    assert response.json['treatments'] == [{'id': 2}, {'id': 3}]
+
+    response = client.get('/api/treatment/all?q=ANGST paniek&fields=id')
+    assert response.json['treatments'] == [{'id': 2}, {'id': 3}]
+
+    response = client.get('/api/treatment/all?q=somber indigo&fields=id')
+    assert response.json['treatments'] == [{'id': 4}]
+
+    response = client.get('/api/treatment/all?q=onbekend')
+    assert response.json == {'treatments': [], 'total': 0, 'next_cursor': None}
+
+
+def test_index():
+    index = TreatmentIndex(['Alcohol & ik', 'Één glas', 'Angst en paniek'])
+    assert index.search('een') == [1]
+    assert index.search('a') == [0, 2]
+    assert index.search('an pan') == [2]
+    assert index.search('') == []
+
+
+def test_batch(client: FlaskClient, auth: AuthActions):
+    assert client.get('/api/treatment?ids=1').status_code == 403
+    auth.login()
+
+    response = client.get('/api/treatment?ids=3,99,1,3')
+    assert response.status_code == 200
+    assert [treatment['id'] for treatment in response.json['treatments']] == [3, 1]
+    assert response.json['missing'] == [99]
+
+    assert client.get('/api/treatment?ids=1,x').status_code == 400
+    assert client.get('/api/treatment').status_code == 400
+    assert client.get('/api/treatment?ids=' + ','.join(str(i) for i in range(101))).status_code == 400
+
+
+def test_etag(client: FlaskClient, auth: AuthActions):
+    auth.login()
+
+    for url in ['/api/treatment/all', '/api/treatment/2', '/api/treatment/current', '/api/treatment?ids=1,2',
+                '/api/treatment/all?fields=id']:
+        response = client.get(url)
+        etag = response.headers['ETag']
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+    assert client.get('/api/treatment/1', headers={'If-None-Match': etag}).status_code == 200
@@ -13,3 +13,13 @@ def test_current(client: FlaskClient, auth: AuthActions):
     response = client.get('/api/user/current')
     assert response.status_code == 200
     assert response.json['reference'] == 'Person/fa1636df'
+
+
+def test_current_etag(client: FlaskClient, auth: AuthActions):
+    auth.login()
+
+    response = client.get('/api/user/current')
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    response = client.get('/api/user/current', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304